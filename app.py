@@ -1,26 +1,67 @@
 import asyncio
+import functools
 import logging
 import os
 import re
-from typing import List, Dict, Any, Iterable
+import time
+from typing import Any, Dict, Iterable, List, Optional
 
-from aiogram import Bot, types, exceptions
+from aiogram import Bot, types
 from aiogram.dispatcher import Dispatcher
 from aiogram.utils import executor
-
-from keyboards import positions, position_keyboard, get_state_keyboard, get_cities_keyboard, states_list, all_cities
-from models.models import User
-from setup_db import db
-from start_app import start_app
-from utils.utils import create_user, write_vacancies, send_one_vacancy, send_logs, get_db_file
-from utils.utils import first_vacancies, open_vacancies, get_vacancies, delete_files_from_folder
-
-app = start_app(db)
+from aiohttp import web
+from dotenv import load_dotenv
+
+from keyboards import positions, position_keyboard, get_state_keyboard, get_cities_keyboard, is_state, is_city
+from models.repository import init_repository, shutdown_repository, get_user, get_user_by_username, create_user
+from models.repository import update_city, delete_user_by_username, delete_users_by_chat_ids
+from models.repository import get_subscriptions, get_user_stats, get_users_page, USERS_PAGE_SIZE
+from models.repository import upsert_vacancies, get_latest_vacancies, has_vacancies, delete_old_vacancies
+from models.user_cache import user_cache
+from setup_db import create_db_engine
+from utils.utils import send_logs
+from utils.utils import first_vacancies, open_vacancies
+from utils import crawler_state
+from utils.change_image import shutdown_executor
+from utils.detail_cache import detail_cache
+from utils.hh_client import close_session
+from utils.logs import setup_logging
+from utils.metrics import HandlerTimingMiddleware, registry, start_metrics_server
+from utils.pipeline import CrawlPipeline, PositionStats
+from utils.reports import USERS_PAGE_CALLBACK, export_users_csv, format_user_stats, format_users_page
+from utils.reports import split_message, users_page_keyboard
+from utils.poll_scheduler import PollScheduler
+from utils.delivery import DeliveryScheduler
+from utils.job_queue import JobQueue, QueuedDelivery
+from utils.routing import RoutingIndex
+from utils.seen_index import seen_index
+from utils.snapshots import MAX_UPLOAD_SIZE, SNAPSHOT_INTERVAL, prune_snapshots, run_periodic_snapshots
+from utils.snapshots import take_snapshot_async
+from utils.vacancy_cards import VacancyCardCache
+from utils.webhook import UpdateTracker, WebhookConfig, use_api_server
+
+load_dotenv()
+engine = create_db_engine()
+init_repository(engine)
 TOKEN = os.getenv('TOKEN')
+use_api_server()
 bot = Bot(token=TOKEN)
 dp = Dispatcher(bot)
+dp.middleware.setup(HandlerTimingMiddleware())
+
+setup_logging()
 
-logging.basicConfig(filename='./logs.txt', level=logging.INFO, format='%(asctime)s - %(message)s')
+positions_name: tuple = ('python_web', 'data_analyst', 'qa', 'java', 'javascript')
+
+LOGS_INTERVAL = 3600
+logs_sent_at = time.monotonic()
+poll_scheduler: Optional[PollScheduler] = None
+webhook_config = WebhookConfig.from_env()
+DELIVERY_MODE = os.getenv('DELIVERY_MODE', 'local')
+job_queue = JobQueue()
+update_tracker = UpdateTracker()
+metrics_runner = None
+snapshot_task: Optional[asyncio.Task] = None
 
 
 
@@ -37,7 +78,7 @@ async def cmd_start(msg: types.Message):
     and sends a message asking the user to select a position, with a reply keyboard for
     choosing the position.
     """
-    user = db.session.query(User).filter(User.user_id == msg.from_user.id).first()
+    user = await get_user(msg.from_user.id)
     if user:
         markup: any = types.ReplyKeyboardRemove(True)
         await bot.send_message(msg.chat.id, 'Вы уже зарегистрированы', reply_markup=markup)
@@ -76,7 +117,7 @@ async def get_commands(msg: types.Message):
 
 @dp.message_handler(commands='set_location')
 async def set_location(msg: types.Message):
-    user = db.session.query(User).filter(User.user_id == msg.from_user.id).first()
+    user = await get_user(msg.from_user.id)
     if user:
         states_keyboard = get_state_keyboard()
         await bot.send_message(msg.chat.id, "Выберите область из списка", reply_markup=states_keyboard)
@@ -84,14 +125,12 @@ async def set_location(msg: types.Message):
         markup: any = types.ReplyKeyboardRemove(True)
         await bot.send_message(msg.chat.id, 'Для выбора локации, нужно подписаться', reply_markup=markup)
     
-@dp.message_handler(lambda msg: msg.text in states_list)
+@dp.message_handler(lambda msg: is_state(msg.text))
 async def set_city(msg: types.Message):
-    user = db.session.query(User).filter(User.user_id == msg.from_user.id).first()
+    user = await get_user(msg.from_user.id)
     if user:
         if msg.text in ['Москва', 'Санкт-Петербург']:
-            user = db.session.query(User).filter(User.user_id == msg.from_user.id).first()
-            user.city = msg.text
-            db.session.commit()
+            await update_city(msg.from_user.id, msg.text)
             markup: any = types.ReplyKeyboardRemove(True)
             await bot.send_message(msg.chat.id, 'Запомнил. Теперь я буду присылать только вакансии, доступные в вашем городе', reply_markup=markup)
         else:
@@ -103,12 +142,9 @@ async def set_city(msg: types.Message):
         
 
 
-@dp.message_handler(lambda msg: msg.text in all_cities)
+@dp.message_handler(lambda msg: is_city(msg.text))
 async def set_user_city(msg: types.Message):
-    user = db.session.query(User).filter(User.user_id == msg.from_user.id).first()
-    if user:
-        user.city = msg.text
-        db.session.commit()
+    if await update_city(msg.from_user.id, msg.text):
         markup: any = types.ReplyKeyboardRemove(True)
         await bot.send_message(msg.chat.id, 'Запомнил. Теперь я буду присылать только вакансии, доступные в вашем городе', reply_markup=markup)
     else:
@@ -119,10 +155,7 @@ async def set_user_city(msg: types.Message):
 
 @dp.message_handler(commands='remove_location')
 async def remove_location(msg: types.Message):
-    user = db.session.query(User).filter(User.user_id == msg.from_user.id).first()
-    user.city = None
-    db.session.add(user)
-    db.session.commit()
+    await update_city(msg.from_user.id, None)
     await bot.send_message(msg.chat.id, 'Запомнил. Теперь я буду отправлять вам вакансии без привязки к локации')
 
 
@@ -132,13 +165,26 @@ async def cmd_get_db(msg: types.Message):
     This function is a message handler for the Telegram bot using the dp object. 
     
     It handles the command 'db' and performs the following actions:
-        - Queries the database for a user with the username 's_tee' and assigns the result to the variable tim.
-        - Retrieves the database file using the get_db_file() function.
-        - Sends the retrieved database file as a document to the chat associated with the user 's_tee'.
+        - Takes a consistent, compressed snapshot of the database in a worker thread
+          (see utils.snapshots) and deletes the oldest snapshots beyond SNAPSHOT_KEEP.
+        - Sends the snapshot as a document to the chat associated with the user 's_tee' (see send_snapshot).
     """
-    tim = db.session.query(User).filter(User.username == 's_tee').first()
-    db_file = get_db_file()
-    await bot.send_document(tim.chat_id, document=db_file)
+    path = await take_snapshot_async(engine)
+    prune_snapshots()
+    await send_snapshot(path)
+
+
+async def send_snapshot(path: str):
+    """
+    This function uploads the database snapshot to the user with username 's_tee'.
+    The file is streamed from the disk. A snapshot over Telegram's 50 MB limit for bots
+    is only kept on the server, and the user gets its path.
+    """
+    tim = await get_user_by_username('s_tee')
+    if os.path.getsize(path) > MAX_UPLOAD_SIZE:
+        await bot.send_message(tim.chat_id, f'Снимок базы {path} больше 50 МБ, он сохранен на сервере')
+        return
+    await bot.send_document(tim.chat_id, document=types.InputFile(path, filename=os.path.basename(path)))
 
 
 @dp.message_handler(commands='unsubscribe')
@@ -153,10 +199,8 @@ async def cmd_unsubscribe(msg: types.Message):
     has unsubscribed. Otherwise, the function sends a message saying "You are not subscribed 
     to the mailing list. To subscribe, use the /start command."
     """
-    user = db.session.query(User).filter(User.username == msg.chat.username).first()
+    user = await delete_user_by_username(msg.chat.username)
     if user:
-        db.session.delete(user)
-        db.session.commit()
         logging.info(f"{msg.chat.full_name}  Отписался")
         markup: any = types.ReplyKeyboardRemove(True)
         await bot.send_message(msg.chat.id, 'Надеемся, Вы отписались потому-что получили оффер ^_^', reply_markup=markup)
@@ -170,17 +214,41 @@ async def cmd_all_users(msg: types.Message):
     """
     This function is a message handler for the command "all_users" in the Telegram bot.
     
-    When the command is received, the function retrieves all the users from the database
-    and counts the number of users. Then, it creates a string containing information about 
-    each user, including their username and position. Then, it sends the message with the 
-    user information to the user with username 's_tee' chat_id.
+    When the command is received, the function counts the users in the database by position
+    and city and the registrations of the last days (SQL aggregates, see utils.reports) and
+    sends the report to the user with username 's_tee', followed by the first page of the
+    user list with a button to the next page (see users_page).
     """
-    users = db.session.query(User).all()
-    tim = db.session.query(User).filter(User.username == 's_tee').first()
-    user_info = f'Всего пользователей - {len(users)}\n'
-    for user in users:
-        user_info += f'@{user.username} - {user.position} - {user.city}\n'
-    await bot.send_message(tim.chat_id, user_info)
+    tim = await get_user_by_username('s_tee')
+    for text in split_message(format_user_stats(await get_user_stats())):
+        await bot.send_message(tim.chat_id, text)
+    users = await get_users_page()
+    await bot.send_message(tim.chat_id, format_users_page(users),
+                           reply_markup=users_page_keyboard(users, USERS_PAGE_SIZE))
+
+
+@dp.callback_query_handler(lambda call: call.data.startswith(USERS_PAGE_CALLBACK))
+async def users_page(call: types.CallbackQuery):
+    """
+    This function is a callback query handler for the 'next page' button of the user list.
+    It replaces the message with the next page of the list, read after the id of the last user
+    of the current page, which is kept in the callback data.
+    """
+    users = await get_users_page(int(call.data[len(USERS_PAGE_CALLBACK):]))
+    await bot.edit_message_text(format_users_page(users), call.message.chat.id, call.message.message_id,
+                                reply_markup=users_page_keyboard(users, USERS_PAGE_SIZE))
+    await call.answer()
+
+
+@dp.message_handler(commands='export_users')
+async def cmd_export_users(msg: types.Message):
+    """
+    This function is a message handler for the command "export_users" in the Telegram bot.
+    It sends the whole user list as a CSV document to the user with username 's_tee'
+    (see utils.reports.export_users_csv).
+    """
+    tim = await get_user_by_username('s_tee')
+    await bot.send_document(tim.chat_id, document=await export_users_csv())
 
 
 @dp.message_handler(commands='logs')
@@ -189,13 +257,33 @@ async def cmd_send_logs(msg: types.Message):
     This function is a message handler for the command "logs" in the Telegram bot. 
     
     When the command is received, the function retrieves the user object with the 
-    username 's_tee' from the database, then call send_logs() function which probably 
-    retrieves the logs from a file or database, and sends the logs as a message to 
-    the user's chat_id.
+    username 's_tee' from the database, then call send_logs() function which 
+    retrieves the last log records with their level and traceback, and sends them to 
+    the user's chat_id, split into messages of Telegram's size limit.
+    '/logs json' sends the structured records of the ring buffer as JSON Lines instead.
     """
-    tim = db.session.query(User).filter(User.username == 's_tee').first()
-    logs = send_logs()
-    await bot.send_message(tim.chat_id, logs)
+    tim = await get_user_by_username('s_tee')
+    logs = send_logs(structured=msg.get_args().strip() == 'json')
+    for part in split_message(logs) or ['Логов пока нет']:
+        await bot.send_message(tim.chat_id, part)
+
+
+@dp.message_handler(commands='stats')
+async def cmd_stats(msg: types.Message):
+    """
+    This function is a message handler for the command "stats" in the Telegram bot.
+
+    When the command is received, the function sends the digest of the metrics (HH requests,
+    vacancies per position, render and send times, send errors, queue depths and handler
+    latencies, see utils.metrics) and the poll scheduler timing to the user with username 's_tee'.
+    The same metrics are served in the Prometheus format on METRICS_PORT.
+    """
+    tim = await get_user_by_username('s_tee')
+    stats = registry.summary() or 'Метрик пока нет'
+    if poll_scheduler is not None:
+        stats += f'\n\nОпрос: {poll_scheduler.summary()}'
+    for text in split_message(stats):
+        await bot.send_message(tim.chat_id, text)
 
 
     
@@ -209,13 +297,13 @@ async def set_position(msg: types.Message):
     the message text matches with any of the predefined positions, it removes the reply 
     keyboard and check if user is already registered if yes it sends a message saying 
     "You are already registered" else it creates a new user with the data 
-    (user_id, chat_id, username, position) and calls open_vacancies and first_vacancies 
+    (user_id, chat_id, username, position) and calls get_latest_vacancies and first_vacancies 
     functions to get the first available job opening for the chosen position and sends 
     the message containing the job opening information to the user. If the message text 
     doesn't match any predefined position, it sends a message saying "I don't know that command".
     """
 
-    user = db.session.query(User).filter(User.user_id == msg.from_user.id).first()
+    user = await get_user(msg.from_user.id)
     
     position_name: str = msg.text.lower()
     position_name: str = re.sub(r' ', '_', position_name)
@@ -223,9 +311,9 @@ async def set_position(msg: types.Message):
     if user:
         await bot.send_message(msg.chat.id, 'Вы уже зарегистрированы', reply_markup=markup)
     else:
-        create_user(user_id=msg.from_user.id, chat_id=msg.chat.id, username=msg.chat.username,
-                    position=position_name)
-        vacancies: List[Dict[str, Any]] = open_vacancies(position_name)
+        await create_user(user_id=msg.from_user.id, chat_id=msg.chat.id, username=msg.chat.username,
+                          position=position_name)
+        vacancies: List[Dict[str, Any]] = await get_latest_vacancies(position_name)
         text: str = first_vacancies(vacancies)
         logging.info(f"{msg.chat.full_name} закончил регистрацию")
         await bot.send_message(msg.chat.id, text, reply_markup=markup, parse_mode=types.ParseMode.HTML)
@@ -242,72 +330,60 @@ async def del_flood_msg(msg: types.Message):
     
 
 
-async def vacancy_for_user():
+async def vacancy_for_user(positions: Iterable[str] = positions_name) -> Dict[str, PositionStats]:
     """
     This function is used to send new job openings to users who are subscribed to a 
-    specific position. It first retrieves all the users from the database and logs the
-    total number of users. Then, it loops through a predefined list of positions. For 
-    each position, it calls the get_vacancies() function to retrieve new job openings 
-    and the open_vacancies() function to retrieve old job openings. Then, it compares
-    the new and old job openings, and sends new job openings to users who are subscribed 
-    to that specific position.
-
-    It also checks if the user is blocked by the bot, if yes it deletes the user from 
-    the database and logs the action.
-
-    It also calls delete_files_from_folder() function to delete files from the folder
-    and calls write_vacancies(new_vacancies, position) to write new vacancies to file
+    specific position. It first builds the routing index of the subscribers (see
+    utils.routing) and logs the total number of users. Then it runs one cycle of the crawl
+    pipeline (see utils.pipeline) for the given positions (all by default) at once: the national search of each
+    position and the area-scoped searches of the cities its subscribers chose (see
+    utils.query_planner) are fetched page by page from their stored watermarks, their detail pages are
+    loaded through the detail cache, the vacancies missing from the seen index of the position
+    (HH ids of the vacancies already sent) are rendered and queued for the users the routing
+    index returns for the position and the vacancy location, and all the found vacancies are
+    upserted into the vacancies table. The stages run concurrently and are connected by bounded
+    queues, so the first cards are sent while the following pages are still loading.
+    The messages are sent by the delivery scheduler (see utils.delivery), which keeps to
+    Telegram's rate limits and retries after flood control. Every vacancy card is rendered
+    (in parallel, off the event loop) and uploaded once per cycle, the other recipients get
+    the Telegram file_id of the uploaded photo (see utils.vacancy_cards).
+    With DELIVERY_MODE=queue the messages are not sent by the bot process: they are queued
+    in the durable job queue, sharded by chat_id, for the broadcast worker processes
+    (see utils.job_queue and utils.broadcast_worker), which also render the cards.
+
+    The chats of the users who blocked the bot, were deactivated or whose chat was not found
+    are collected during the broadcast and deleted from the database with one bulk DELETE when
+    it is over. The broadcast report, with the dead chats counted per reason, is logged.
+
+    It also deletes the vacancies older than the retention period. The position watermark is
+    moved forward only after the upsert, and not at all if its search failed, so an interrupted
+    run is fetched again. Returns the per-position counters of the pipeline.
     """
 
-    users: Iterable = db.session.query(User).all()
-    logging.info(f'Запустился.\nВсего пользователей - {len(users)}')
-    positions_name: tuple = ('python_web', 'data_analyst', 'qa', 'java', 'javascript')
-    for position in positions_name:
-        logging.info(f'Перебираю позиции {position.capitalize()}')
-        new_vacancies: List[Dict[str, Any]] = get_vacancies(position)
-        old_vacancies: List[Dict[str, Any]] = open_vacancies(position)
-        for new_vacancy in new_vacancies:
-            if new_vacancy in old_vacancies:
-                continue
-            else:
-                logging.info(f"Нашел вакансию:\n{new_vacancy['name']}")
-                if users:
-                    for user in users:
-                        if user.city is None:
-                            if user.position == position:
-                                logging.info('Нашел подходящего юзера без города')
-                                vacancy_text, markup, photo = send_one_vacancy(new_vacancy)
-                                try:
-                                    await bot.send_photo(user.chat_id, photo, caption=vacancy_text, reply_markup=markup,
-                                                        parse_mode=types.ParseMode.HTML)
-
-                                except exceptions.BotBlocked:
-                                    db.session.delete(user)
-                                    db.session.commit()
-                                    logging.info(f'Пользователь удален')
-                                    continue
-                            else:
-                                continue
-                        else:
-                            if user.position == position and user.city == new_vacancy['location']:
-                                logging.info('Нашел подходящего юзера с городом')
-                                vacancy_text, markup, photo = send_one_vacancy(new_vacancy)
-                                try:
-                                    await bot.send_photo(user.chat_id, photo, caption=vacancy_text, reply_markup=markup,
-                                                        parse_mode=types.ParseMode.HTML)
-
-                                except exceptions.BotBlocked:
-                                    db.session.delete(user)
-                                    db.session.commit()
-                                    logging.info(f'Пользователь удален')
-                                    continue
-                            else:
-                                continue
-                else:
-                    continue
-        delete_files_from_folder()
-        write_vacancies(new_vacancies, position)
-        logging.info(f'Перезаписал вакансии {position}')
+    routing = RoutingIndex(await get_subscriptions())
+    logging.info(f'Запустился.\nВсего пользователей - {len(routing)}')
+    logging.info(f'Кэш пользователей: {user_cache.stats()}')
+    detail_cache.reset_stats()
+    if DELIVERY_MODE == 'queue':
+        cards = None
+        scheduler = QueuedDelivery(job_queue)
+    else:
+        cards = VacancyCardCache()
+        scheduler = DeliveryScheduler(functools.partial(cards.send, bot))
+    scheduler.start()
+    stats = await CrawlPipeline(routing, scheduler, cards).run(list(positions))
+    logging.info(f'Кэш вакансий: {detail_cache.stats()}')
+    await delete_old_vacancies()
+
+    report = await scheduler.join()
+    for position, position_stats in stats.items():
+        logging.info(f'{position.capitalize()}: {position_stats.summary()}')
+    if report.dead:
+        deleted = await delete_users_by_chat_ids(report.dead)
+        logging.info(f'Удалено пользователей: {deleted} {report.dead_counts}')
+    cards_stats = f', карточек {cards.renders}, загрузок фото {cards.uploads}' if cards else ''
+    logging.info(f'Рассылка: {report.summary()}{cards_stats}')
+    return stats
 
 
 async def send_me_logs():
@@ -315,37 +391,99 @@ async def send_me_logs():
     This function is an asynchronous function called "send_me_logs". It performs 
     the following actions:
 
-     - Queries the "User" table in the "db" session for a user with the username "s_tee" 
+     - Queries the database for a user with the username "s_tee" 
         and assigns the result to the variable "tim".
      - Calls another function "send_logs" and assigns the returned value to a variable "logs".
-     - Sends a message to the chat ID of the user found in step 1 with the logs obtained 
-        in step 2, and the parse mode is set to "types.ParseMode.HTML".
+     - Sends the logs obtained in step 2 to the chat ID of the user found in step 1, as plain
+        text (a traceback is not valid HTML), split into messages of Telegram's size limit.
         
     """
-    tim = db.session.query(User).filter(User.username == 's_tee').first()
+    tim = await get_user_by_username('s_tee')
     logs = send_logs()
-    await bot.send_message(tim.chat_id, logs, parse_mode=types.ParseMode.HTML)
+    for part in split_message(logs):
+        await bot.send_message(tim.chat_id, part)
 
 
-async def repeat_my_function():
+async def poll_positions(positions: List[str]) -> Dict[str, int]:
     """ 
-    This function is an asynchronous function called "repeat_my_function".
-    It is an infinite loop that performs the following actions:
-        - Calls an asynchronous function "vacancy_for_user" and waits for it to complete.
-        - Calls an asynchronous function "send_me_logs" and waits for it to complete.
-        - Pauses the loop for 3600 seconds (1 hour) using the "asyncio.sleep" function.
-
-    This loop will continue indefinitely, repeatedly calling the "vacancy_for_user" and 
-        "send_me_logs" functions and pausing for 1 hour between each iteration.
+    This function is the crawl cycle of the poll scheduler (see utils.poll_scheduler).
+    It runs vacancy_for_user for the positions that are due and returns the number of
+    new vacancies of each of them, which the scheduler uses to adapt the poll intervals.
+    The logs are sent to the admin at most once per LOGS_INTERVAL seconds; a failure to send
+    them is only logged, so it does not count as a failed cycle of the positions.
     """
+    global logs_sent_at
+    stats = await vacancy_for_user(positions)
+    if time.monotonic() - logs_sent_at >= LOGS_INTERVAL:
+        logs_sent_at = time.monotonic()
+        try:
+            await send_me_logs()
+        except Exception as e:
+            logging.exception(f'Не удалось отправить логи: {e!r}')
+    return {position: position_stats.new for position, position_stats in stats.items()}
+
+
+async def import_vacancy_snapshots():
+    """
+    This function imports the vacancies saved in vacancies_json/<position>.json by the previous
+    versions of the bot into the vacancies table, for the positions that have no vacancies in
+    the database yet, and marks them as seen, so they are not sent again.
+    """
+    for position in positions_name:
+        if not await has_vacancies(position):
+            vacancies: List[Dict[str, Any]] = open_vacancies(position)
+            await upsert_vacancies(position, vacancies)
+            await seen_index.seed(position, vacancies)
+            logging.info(f'Импортировал {len(vacancies)} вакансий {position}')
 
-    while True:
-        await vacancy_for_user()
-        await send_me_logs()
-        await asyncio.sleep(3600)  # задержка 1 час
+
+async def on_startup(dispatcher: Dispatcher):
+    """
+    This function is called by the executor when the bot starts.
+    It imports the saved vacancies on the first start (see import_vacancy_snapshots)
+    starts the metrics server (if METRICS_PORT is set), the periodic database snapshots (if SNAPSHOT_INTERVAL
+    is set) and the poll scheduler. In webhook mode it also registers the webhook with Telegram,
+    unless WEBHOOK_URL is empty (local mode, e.g. to replay recorded updates with utils.webhook).
+    """
+    global poll_scheduler, metrics_runner, snapshot_task
+    await import_vacancy_snapshots()
+    metrics_runner = await start_metrics_server()
+    if SNAPSHOT_INTERVAL:
+        snapshot_task = asyncio.ensure_future(run_periodic_snapshots(engine, send_snapshot))
+    if webhook_config.enabled and webhook_config.webhook_url:
+        await bot.set_webhook(webhook_config.webhook_url, max_connections=webhook_config.max_connections)
+        logging.info(f'Вебхук: {webhook_config.webhook_url}')
+    poll_scheduler = PollScheduler(poll_positions, positions_name)
+    poll_scheduler.start()
+
+
+async def on_shutdown(dispatcher: Dispatcher):
+    """
+    This function is called by the executor when the bot stops.
+    It waits for the webhook updates being processed, stops the periodic database snapshots and
+    the poll scheduler (waiting for the running cycle), closes the shared HeadHunter HTTP session and stops the render
+    and database pools.
+    """
+    await update_tracker.drain()
+    if snapshot_task is not None:
+        snapshot_task.cancel()
+        await asyncio.gather(snapshot_task, return_exceptions=True)
+    if poll_scheduler is not None:
+        await poll_scheduler.stop()
+    await close_session()
+    job_queue.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    shutdown_executor()
+    shutdown_repository()
+    crawler_state.close()
 
 
 if __name__ == '__main__':
-    #loop = asyncio.get_event_loop()
-    #loop.create_task(repeat_my_function())
-    executor.start_polling(dp)
+    if webhook_config.enabled:
+        executor.set_webhook(dp, webhook_config.path, on_startup=on_startup, on_shutdown=on_shutdown,
+                             check_ip=webhook_config.check_ip,
+                             web_app=web.Application(middlewares=[update_tracker.middleware])
+                             ).run_app(host=webhook_config.host, port=webhook_config.port, loop=dp.loop)
+    else:
+        executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown)
@@ -1,8 +1,12 @@
 import json
-from pprint import pprint
+import os
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Tuple
 
 from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
 
+STATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vacancies_json', 'states.json')
+
 positions = ('Python Web', 'Data Analyst', 'QA', 'Java', 'JavaScript')
 
 position_keyboard = ReplyKeyboardMarkup()
@@ -11,58 +15,66 @@ position_keyboard.add(KeyboardButton('Python Web'), KeyboardButton('Data Analyst
                       KeyboardButton('JavaScript'))
 
 
+@lru_cache(maxsize=None)
 def areas():
-    with open('vacancies_json/states.json') as file:
+    with open(STATES_PATH) as file:
         cities = json.load(file)
     return cities
 
 
+@lru_cache(maxsize=None)
+def get_region_cities() -> Dict[str, Tuple[str, ...]]:
+    """
+    Region name -> names of its cities, in the order of states.json.
+    """
+    return {state['state']: tuple(city['name'] for city in state['cities']) for state in areas()}
+
+
+@lru_cache(maxsize=None)
 def get_state_keyboard():
-    states = areas()
     states_keyboard = ReplyKeyboardMarkup()
-    for state in states:
-        states_keyboard.add(KeyboardButton(state['state']))
+    for state in get_region_cities():
+        states_keyboard.add(KeyboardButton(state))
     return states_keyboard
 
 
-def get_states_list():
-    states_list = []
-    states = areas()
-    for state in states:
-        states_list.append(state['state'])
-    return states_list
+def get_states_list() -> List[str]:
+    return list(get_region_cities())
 
 
+@lru_cache(maxsize=None)
 def get_cities_keyboard(state_name):
-    states = areas()
     cities_keyboard = ReplyKeyboardMarkup()
-    for state in states:
-        if state['state'] == state_name:
-            for city in state['cities']:
-                cities_keyboard.add(KeyboardButton(city['name']))
+    for city in get_region_cities().get(state_name, ()):
+        cities_keyboard.add(KeyboardButton(city))
     return cities_keyboard
 
 
+def get_cities_list(state_name) -> List[str]:
+    return list(get_region_cities().get(state_name, ()))
+
+
+def get_all_cities() -> List[str]:
+    return [city for cities in get_region_cities().values() for city in cities]
+
+
+@lru_cache(maxsize=None)
+def _state_names() -> FrozenSet[str]:
+    return frozenset(get_region_cities())
 
-def get_cities_list(state_name):
-    cities_list = []
-    states = areas()
-    for state in states['areas']:
-        if state['name'] == state_name:
-            for city in state['areas']:
-                cities_list.append(city['name'])
-    return cities_list
 
+@lru_cache(maxsize=None)
+def _city_names() -> FrozenSet[str]:
+    return frozenset(get_all_cities())
 
-def get_all_cities():
-    all_cities = []
-    states = areas()
-    for state in states:
-            for city in state['cities']:
-                all_cities.append(city['name'])
-    return all_cities
 
+def is_state(name) -> bool:
+    """
+    Whether the text is one of the regions of states.json. The file is read on the first call,
+    not when the bot starts.
+    """
+    return name in _state_names()
 
-all_cities = get_all_cities()
-states_list = get_states_list()
 
+def is_city(name) -> bool:
+    return name in _city_names()
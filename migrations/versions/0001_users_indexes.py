@@ -0,0 +1,46 @@
+"""users table indexes
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+INDEXED_COLUMNS = ('user_id', 'username', 'position', 'city')
+
+
+def upgrade():
+    # Existing databases were created with db.create_all(), so the table may already exist.
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('users'):
+        op.create_table('users',
+                        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+                        sa.Column('user_id', sa.Integer(), nullable=False),
+                        sa.Column('chat_id', sa.Integer(), nullable=False),
+                        sa.Column('username', sa.String(length=50), nullable=True),
+                        sa.Column('position', sa.String(length=25), nullable=False),
+                        sa.Column('city', sa.String(length=100), nullable=True),
+                        sa.PrimaryKeyConstraint('id'))
+        existing = set()
+    else:
+        existing = {index['name'] for index in inspector.get_indexes('users')}
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        for column in INDEXED_COLUMNS:
+            if f'ix_users_{column}' not in existing:
+                batch_op.create_index(f'ix_users_{column}', [column], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        for column in INDEXED_COLUMNS:
+            batch_op.drop_index(f'ix_users_{column}')
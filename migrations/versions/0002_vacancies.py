@@ -0,0 +1,49 @@
+"""vacancies table
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # db.create_all() at startup may have created the table already.
+    if sa.inspect(op.get_bind()).has_table('vacancies'):
+        return
+    op.create_table('vacancies',
+                    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+                    sa.Column('hh_id', sa.String(length=20), nullable=False),
+                    sa.Column('position', sa.String(length=25), nullable=False),
+                    sa.Column('name', sa.String(length=255), nullable=False),
+                    sa.Column('salary', sa.String(length=100), nullable=True),
+                    sa.Column('company', sa.String(length=255), nullable=True),
+                    sa.Column('created_at', sa.String(length=30), nullable=True),
+                    sa.Column('published_at', sa.DateTime(), nullable=False),
+                    sa.Column('schedule', sa.String(length=100), nullable=True),
+                    sa.Column('experience', sa.String(length=100), nullable=True),
+                    sa.Column('location', sa.String(length=100), nullable=True),
+                    sa.Column('description', sa.Text(), nullable=True),
+                    sa.Column('requirements', sa.Text(), nullable=True),
+                    sa.Column('skills', sa.Text(), nullable=True),
+                    sa.Column('url', sa.String(length=255), nullable=True),
+                    sa.PrimaryKeyConstraint('id'),
+                    sa.UniqueConstraint('position', 'hh_id', name='uq_vacancies_position_hh_id'))
+    with op.batch_alter_table('vacancies', schema=None) as batch_op:
+        batch_op.create_index('ix_vacancies_hh_id', ['hh_id'], unique=False)
+        batch_op.create_index('ix_vacancies_location', ['location'], unique=False)
+        batch_op.create_index('ix_vacancies_published_at', ['published_at'], unique=False)
+        batch_op.create_index('ix_vacancies_position_published_at', ['position', 'published_at'], unique=False)
+
+
+def downgrade():
+    op.drop_table('vacancies')
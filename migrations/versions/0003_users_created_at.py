@@ -0,0 +1,34 @@
+"""users.created_at
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Users registered before this revision keep a NULL created_at: their registration time is unknown.
+    inspector = sa.inspect(op.get_bind())
+    columns = {column['name'] for column in inspector.get_columns('users')}
+    indexes = {index['name'] for index in inspector.get_indexes('users')}
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        if 'created_at' not in columns:
+            batch_op.add_column(sa.Column('created_at', sa.DateTime(), nullable=True))
+        if 'ix_users_created_at' not in indexes:
+            batch_op.create_index('ix_users_created_at', ['created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index('ix_users_created_at')
+        batch_op.drop_column('created_at')
@@ -0,0 +1,41 @@
+"""users.user_id and users.chat_id as BIGINT
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+ID_COLUMNS = ('user_id', 'chat_id')
+
+
+def upgrade():
+    # Telegram ids do not fit in a 32-bit INTEGER on Postgres. SQLite integers are 64-bit already,
+    # so its table is not rebuilt.
+    bind = op.get_bind()
+    if bind.dialect.name == 'sqlite':
+        return
+    columns = {column['name']: column['type'] for column in sa.inspect(bind).get_columns('users')}
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        for column in ID_COLUMNS:
+            if not isinstance(columns[column], sa.BigInteger):
+                batch_op.alter_column(column, existing_type=sa.Integer(), type_=sa.BigInteger(),
+                                      existing_nullable=False)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        return
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        for column in ID_COLUMNS:
+            batch_op.alter_column(column, existing_type=sa.BigInteger(), type_=sa.Integer(),
+                                  existing_nullable=False)
@@ -1,11 +1,59 @@
-from setup_db import db
+from datetime import datetime, timezone
 
+from sqlalchemy import BigInteger, Column, DateTime, Index, Integer, String, Text, UniqueConstraint
 
-class User(db.Model):
+from setup_db import Base
+
+
+class User(Base):
     __tablename__ = 'users'
-    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    user_id = db.Column(db.Integer, nullable=False)
-    chat_id = db.Column(db.Integer, nullable=False)
-    username = db.Column(db.String(50))
-    position = db.Column(db.String(25), nullable=False)
-    city = db.Column(db.String(100), nullable=True, default=None)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(BigInteger, nullable=False, index=True)
+    chat_id = Column(BigInteger, nullable=False)
+    username = Column(String(50), index=True)
+    position = Column(String(25), nullable=False, index=True)
+    city = Column(String(100), nullable=True, default=None, index=True)
+    created_at = Column(DateTime, nullable=True, default=datetime.utcnow, index=True)
+
+
+class Vacancy(Base):
+    __tablename__ = 'vacancies'
+    __table_args__ = (
+        UniqueConstraint('position', 'hh_id', name='uq_vacancies_position_hh_id'),
+        Index('ix_vacancies_position_published_at', 'position', 'published_at'),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    hh_id = Column(String(20), nullable=False, index=True)
+    position = Column(String(25), nullable=False)
+    name = Column(String(255), nullable=False)
+    salary = Column(String(100))
+    company = Column(String(255))
+    created_at = Column(String(30))
+    published_at = Column(DateTime, nullable=False, index=True)
+    schedule = Column(String(100))
+    experience = Column(String(100))
+    location = Column(String(100), index=True)
+    description = Column(Text)
+    requirements = Column(Text)
+    skills = Column(Text)
+    url = Column(String(255))
+
+    DICT_FIELDS = ('name', 'salary', 'company', 'created_at', 'schedule', 'experience', 'location',
+                   'description', 'requirements', 'skills', 'url')
+
+    @classmethod
+    def values_from_dict(cls, position: str, hh_id: str, vacancy: dict) -> dict:
+        """
+        Column values of a vacancy dictionary built by utils.utils.parse_vacancy.
+        published_at is stored as naive UTC, so vacancies sort correctly whatever their offset.
+        """
+        published_at = datetime.strptime(vacancy['published_at'], '%Y-%m-%dT%H:%M:%S%z')
+        values = {field: vacancy.get(field) for field in cls.DICT_FIELDS}
+        values.update(position=position, hh_id=hh_id,
+                      published_at=published_at.astimezone(timezone.utc).replace(tzinfo=None))
+        return values
+
+    def to_dict(self) -> dict:
+        vacancy = {field: getattr(self, field) for field in self.DICT_FIELDS}
+        vacancy['published_at'] = self.published_at.strftime('%Y-%m-%dT%H:%M:%S+0000')
+        return vacancy
@@ -0,0 +1,349 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from models.models import User, Vacancy
+from models.user_cache import user_cache
+from utils.utils import vacancy_id
+
+T = TypeVar('T')
+
+UPSERT_CHUNK_SIZE = 50
+VACANCY_RETENTION_DAYS = 30
+USERS_PAGE_SIZE = 20
+EXPORT_BATCH_SIZE = 1000
+GROWTH_DAYS = 14
+
+_session_factory: Optional[sessionmaker] = None
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+@dataclass(frozen=True)
+class UserProfile:
+    """
+    Plain copy of a users row. It is returned instead of the ORM object, so it can be used
+    after its session is closed and passed between threads.
+    """
+    id: int
+    user_id: int
+    chat_id: int
+    username: Optional[str]
+    position: str
+    city: Optional[str]
+    created_at: Optional[datetime] = None
+
+    @classmethod
+    def from_user(cls, user: User) -> 'UserProfile':
+        return cls(user.id, user.user_id, user.chat_id, user.username, user.position, user.city, user.created_at)
+
+
+@dataclass(frozen=True)
+class UserStats:
+    """
+    Aggregates of the users table for the admin report: the total, the number of users per
+    (position, city) (city None for the users without a location), the number of users registered
+    per day since `since` (day as 'YYYY-MM-DD') and the number of users registered before their
+    registration time was recorded.
+    """
+    total: int
+    by_position_city: List[Tuple[str, Optional[str], int]]
+    new_by_day: List[Tuple[str, int]]
+    since: datetime
+    unknown_created_at: int
+
+
+def init_repository(engine: Engine) -> None:
+    """
+init_repository(engine: Engine) -> None
+This function binds the data access layer to the database engine.
+All queries run in a dedicated thread pool, one session per call: a single thread for SQLite,
+which has one writer anyway, and a few threads for server databases such as Postgres.
+"""
+    global _session_factory, _executor
+    _session_factory = sessionmaker(bind=engine, expire_on_commit=False)
+    _executor = ThreadPoolExecutor(max_workers=1 if engine.dialect.name == 'sqlite' else 4,
+                                   thread_name_prefix='db')
+
+
+def shutdown_repository() -> None:
+    """
+shutdown_repository() -> None
+This function waits for the running queries and stops the database thread pool.
+"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+    _executor = None
+
+
+def _unit_of_work(func: Callable[..., T], args: Tuple[Any, ...]) -> T:
+    session: Session = _session_factory()
+    try:
+        result = func(session, *args)
+        session.commit()
+        return result
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+async def run_in_session(func: Callable[..., T], *args: Any) -> T:
+    """
+run_in_session(func, *args) -> T
+This function runs func(session, *args) in the database thread pool with a new session,
+commits it (or rolls it back on error) and returns the result, without blocking the event loop.
+"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _unit_of_work, func, args)
+
+
+def _get_user(session: Session, user_id: int) -> Optional[UserProfile]:
+    user = session.query(User).filter(User.user_id == user_id).first()
+    return UserProfile.from_user(user) if user else None
+
+
+def _get_user_by_username(session: Session, username: str) -> Optional[UserProfile]:
+    user = session.query(User).filter(User.username == username).first()
+    return UserProfile.from_user(user) if user else None
+
+
+def _create_user(session: Session, user_id: int, chat_id: int, username: Optional[str], position: str) -> UserProfile:
+    user = User(user_id=user_id, chat_id=chat_id, username=username, position=position)
+    session.add(user)
+    session.flush()
+    return UserProfile.from_user(user)
+
+
+def _update_city(session: Session, user_id: int, city: Optional[str]) -> Optional[UserProfile]:
+    user = session.query(User).filter(User.user_id == user_id).first()
+    if user is None:
+        return None
+    user.city = city
+    return UserProfile.from_user(user)
+
+
+def _delete_user_by_username(session: Session, username: str) -> Optional[UserProfile]:
+    user = session.query(User).filter(User.username == username).first()
+    if user is None:
+        return None
+    session.delete(user)
+    return UserProfile.from_user(user)
+
+
+def _delete_users_by_chat_ids(session: Session, chat_ids: List[int]) -> int:
+    return session.query(User).filter(User.chat_id.in_(chat_ids)).delete(synchronize_session=False)
+
+
+def _get_subscriptions(session: Session) -> List[Tuple[int, str, Optional[str]]]:
+    return [tuple(row) for row in session.query(User.chat_id, User.position, User.city)]
+
+
+def _get_user_stats(session: Session, since: datetime) -> UserStats:
+    count = func.count(User.id)
+    day = func.date(User.created_at)
+    by_position_city = (session.query(User.position, User.city, count)
+                        .group_by(User.position, User.city).order_by(User.position, count.desc()))
+    new_by_day = (session.query(day, count).filter(User.created_at >= since)
+                  .group_by(day).order_by(day))
+    return UserStats(total=session.query(count).scalar(),
+                     by_position_city=[tuple(row) for row in by_position_city],
+                     new_by_day=[(str(row_day), row_count) for row_day, row_count in new_by_day],
+                     since=since,
+                     unknown_created_at=session.query(count).filter(User.created_at.is_(None)).scalar())
+
+
+def _get_users_page(session: Session, after_id: int, limit: int) -> List[UserProfile]:
+    users = session.query(User).filter(User.id > after_id).order_by(User.id).limit(limit)
+    return [UserProfile.from_user(user) for user in users]
+
+
+def _upsert_vacancies(session: Session, rows: List[Dict[str, Any]]) -> int:
+    insert = postgresql.insert if session.get_bind().dialect.name == 'postgresql' else sqlite.insert
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        statement = insert(Vacancy.__table__).values(rows[start:start + UPSERT_CHUNK_SIZE])
+        statement = statement.on_conflict_do_update(
+            index_elements=['position', 'hh_id'],
+            set_={column: statement.excluded[column] for column in rows[0] if column not in ('position', 'hh_id')})
+        session.execute(statement)
+    return len(rows)
+
+
+def _get_latest_vacancies(session: Session, position: str, limit: int) -> List[Dict[str, Any]]:
+    vacancies = (session.query(Vacancy).filter(Vacancy.position == position)
+                 .order_by(Vacancy.published_at.desc()).limit(limit))
+    return [vacancy.to_dict() for vacancy in vacancies]
+
+
+def _has_vacancies(session: Session, position: str) -> bool:
+    return session.query(Vacancy.id).filter(Vacancy.position == position).first() is not None
+
+
+def _delete_vacancies_before(session: Session, before: datetime, keep: int) -> int:
+    deleted = 0
+    for (position,) in session.query(Vacancy.position).distinct():
+        kept_from = (session.query(Vacancy.published_at).filter(Vacancy.position == position)
+                     .order_by(Vacancy.published_at.desc()).offset(keep - 1).limit(1).scalar())
+        if kept_from is None:
+            continue
+        deleted += (session.query(Vacancy)
+                    .filter(Vacancy.position == position, Vacancy.published_at < min(before, kept_from))
+                    .delete(synchronize_session=False))
+    return deleted
+
+
+async def get_user(user_id: int) -> Optional[UserProfile]:
+    """
+get_user(user_id: int) -> Optional[UserProfile]
+This function returns the user with the given Telegram user id, or None if they are not registered.
+The answer comes from the user profile cache when possible (see models.user_cache).
+"""
+    cached, profile = user_cache.get(user_id)
+    if cached:
+        return profile
+    generation = user_cache.generation
+    profile = await run_in_session(_get_user, user_id)
+    user_cache.fill(user_id, profile, generation)
+    return profile
+
+
+async def get_user_by_username(username: str) -> Optional[UserProfile]:
+    """
+get_user_by_username(username: str) -> Optional[UserProfile]
+This function returns the user with the given Telegram username, or None.
+"""
+    return await run_in_session(_get_user_by_username, username)
+
+
+async def create_user(user_id: int, chat_id: int, username: Optional[str], position: str) -> UserProfile:
+    """
+create_user(user_id: int, chat_id: int, username: str, position: str) -> UserProfile
+This function creates a new user and adds it to the database.
+"""
+    profile = await run_in_session(_create_user, user_id, chat_id, username, position)
+    user_cache.put(user_id, profile)
+    return profile
+
+
+async def update_city(user_id: int, city: Optional[str]) -> Optional[UserProfile]:
+    """
+update_city(user_id: int, city: Optional[str]) -> Optional[UserProfile]
+This function sets (or with None removes) the city of the user.
+Returns the updated profile, or None if the user is not registered.
+"""
+    profile = await run_in_session(_update_city, user_id, city)
+    user_cache.put(user_id, profile)
+    return profile
+
+
+async def delete_user_by_username(username: str) -> Optional[UserProfile]:
+    """
+delete_user_by_username(username: str) -> Optional[UserProfile]
+This function deletes the user with the given username and returns the deleted profile,
+or None if there was no such user.
+"""
+    profile = await run_in_session(_delete_user_by_username, username)
+    if profile is not None:
+        user_cache.put(profile.user_id, None)
+    return profile
+
+
+async def delete_users_by_chat_ids(chat_ids: Iterable[int]) -> int:
+    """
+delete_users_by_chat_ids(chat_ids: Iterable[int]) -> int
+This function deletes the users with the given chat ids and returns how many were deleted.
+"""
+    chat_ids = list(chat_ids)
+    if not chat_ids:
+        return 0
+    deleted = await run_in_session(_delete_users_by_chat_ids, chat_ids)
+    user_cache.discard_chats(chat_ids)
+    return deleted
+
+
+async def get_subscriptions() -> List[Tuple[int, str, Optional[str]]]:
+    """
+get_subscriptions() -> List[Tuple[int, str, Optional[str]]]
+This function returns (chat_id, position, city) of every user.
+"""
+    return await run_in_session(_get_subscriptions)
+
+
+async def get_user_stats(days: int = GROWTH_DAYS) -> UserStats:
+    """
+get_user_stats(days: int = GROWTH_DAYS) -> UserStats
+This function counts the users in the database (COUNT ... GROUP BY), without loading them:
+in total, per position and city, and registered per day over the last `days` days.
+"""
+    since = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+    return await run_in_session(_get_user_stats, since)
+
+
+async def get_users_page(after_id: int = 0, limit: int = USERS_PAGE_SIZE) -> List[UserProfile]:
+    """
+get_users_page(after_id: int = 0, limit: int = USERS_PAGE_SIZE) -> List[UserProfile]
+This function returns the next `limit` users in the order of registration, after the user with
+the row id `after_id` (keyset pagination: the query seeks by the primary key, so every page is
+as fast as the first one). Pass the id of the last user of a page to get the next page.
+"""
+    return await run_in_session(_get_users_page, after_id, limit)
+
+
+async def iter_users(batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[List[UserProfile]]:
+    """
+iter_users(batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[List[UserProfile]]
+This function yields all the users, `batch_size` at a time, with get_users_page, so at most
+one batch is in memory.
+"""
+    after_id = 0
+    while True:
+        users = await get_users_page(after_id, batch_size)
+        if not users:
+            return
+        yield users
+        after_id = users[-1].id
+
+
+async def upsert_vacancies(position: str, vacancies: List[Dict[str, Any]]) -> int:
+    """
+upsert_vacancies(position: str, vacancies: List[dict]) -> int
+This function inserts the vacancies of the position, or updates the ones already stored
+(matched by position and HH id), in one transaction. Returns the number of vacancies written.
+"""
+    rows = [Vacancy.values_from_dict(position, vacancy_id(vacancy), vacancy) for vacancy in vacancies]
+    if not rows:
+        return 0
+    return await run_in_session(_upsert_vacancies, rows)
+
+
+async def get_latest_vacancies(position: str, limit: int = 5) -> List[Dict[str, Any]]:
+    """
+get_latest_vacancies(position: str, limit: int = 5) -> List[dict]
+This function returns the `limit` most recently published vacancies of the position.
+"""
+    return await run_in_session(_get_latest_vacancies, position, limit)
+
+
+async def has_vacancies(position: str) -> bool:
+    """
+has_vacancies(position: str) -> bool
+This function returns True if any vacancy of the position is stored.
+"""
+    return await run_in_session(_has_vacancies, position)
+
+
+async def delete_old_vacancies(days: int = VACANCY_RETENTION_DAYS, keep: int = 5) -> int:
+    """
+delete_old_vacancies(days: int = VACANCY_RETENTION_DAYS, keep: int = 5) -> int
+This function deletes the vacancies published more than `days` days ago, except the `keep`
+newest vacancies of every position, which new subscribers get in the welcome message.
+"""
+    return await run_in_session(_delete_vacancies_before, datetime.utcnow() - timedelta(days=days), keep)
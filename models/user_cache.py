@@ -0,0 +1,85 @@
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+MAX_USERS = 10000
+
+_MISSING = object()
+
+
+class UserProfileCache:
+    """
+UserProfileCache(max_size: int = MAX_USERS)
+In-process LRU cache of user profiles keyed by the Telegram user id.
+
+The repository keeps it up to date (write-through): profiles are stored when they are read
+or created and replaced or dropped when they are updated or deleted. Unregistered users are
+cached as None, so repeated /start messages of a new user do not query the database either.
+Every write bumps `generation`; fill() stores the result of a read only if no write happened
+while the query was running, so a slow read can't overwrite a newer profile.
+"""
+
+    def __init__(self, max_size: int = MAX_USERS):
+        self.max_size = max_size
+        self._profiles: 'OrderedDict[int, Any]' = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Tuple[bool, Any]:
+        """
+get(user_id: int) -> Tuple[bool, Optional[UserProfile]]
+This function returns (True, profile) if the user is cached (profile is None for a cached
+unregistered user) and (False, None) otherwise.
+"""
+        profile = self._profiles.get(user_id, _MISSING)
+        if profile is _MISSING:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        self._profiles.move_to_end(user_id)
+        return True, profile
+
+    def fill(self, user_id: int, profile: Optional[Any], generation: int) -> None:
+        """
+fill(user_id: int, profile: Optional[UserProfile], generation: int) -> None
+This function caches the result of a read started at `generation`.
+"""
+        if generation == self.generation:
+            self._store(user_id, profile)
+
+    def put(self, user_id: int, profile: Optional[Any]) -> None:
+        """
+put(user_id: int, profile: Optional[UserProfile]) -> None
+This function caches the result of a write (None for a deleted user).
+"""
+        self.generation += 1
+        self._store(user_id, profile)
+
+    def _store(self, user_id: int, profile: Optional[Any]) -> None:
+        self._profiles[user_id] = profile
+        self._profiles.move_to_end(user_id)
+        while len(self._profiles) > self.max_size:
+            self._profiles.popitem(last=False)
+
+    def discard_chats(self, chat_ids: Iterable[int]) -> None:
+        """
+discard_chats(chat_ids) -> None
+This function drops the cached profiles of the given chats, e.g. after a bulk delete.
+"""
+        self.generation += 1
+        chat_ids = set(chat_ids)
+        for user_id, profile in list(self._profiles.items()):
+            if profile is not None and profile.chat_id in chat_ids:
+                del self._profiles[user_id]
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._profiles.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {'size': len(self._profiles), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0}
+
+
+user_cache = UserProfileCache()
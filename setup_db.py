@@ -1,3 +1,53 @@
-from flask_sqlalchemy import SQLAlchemy
+import os
+import sqlite3
 
-db = SQLAlchemy()
\ No newline at end of file
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import declarative_base
+
+INSTANCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+
+Base = declarative_base()
+
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    """
+    Every new SQLite connection uses the write-ahead log, so readers don't wait for the writer,
+    and waits up to 5 seconds for a lock instead of failing with "database is locked".
+    """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute('PRAGMA busy_timeout=5000')
+        cursor.close()
+
+
+def database_url() -> str:
+    """
+database_url() -> str
+This function returns the database URI from the DATABASE_URL environment variable or the
+default SQLite database. The 'postgres://' scheme used by some hosting providers is
+rewritten to 'postgresql://', which is the one SQLAlchemy accepts. A relative SQLite path
+is relative to the 'instance' directory, as with Flask-SQLAlchemy, so the bot and the
+migrations (see start_app) use the same file.
+"""
+    url = os.getenv('DATABASE_URL', 'sqlite:///database.db')
+    if url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    parsed = make_url(url)
+    if parsed.get_backend_name() == 'sqlite' and parsed.database not in (None, '', ':memory:') \
+            and not parsed.database.startswith('file:') and not os.path.isabs(parsed.database):
+        os.makedirs(INSTANCE_DIR, exist_ok=True)
+        url = parsed.set(database=os.path.join(INSTANCE_DIR, parsed.database)).render_as_string(hide_password=False)
+    return url
+
+
+def create_db_engine(url: str = None) -> Engine:
+    """
+create_db_engine(url: str = None) -> Engine
+This function creates the SQLAlchemy engine of the bot for the url (database_url() by default).
+It does not create the tables: the schema is managed by the migrations ('flask db upgrade').
+"""
+    return create_engine(url or database_url())
@@ -1,8 +1,12 @@
 from flask import Flask
 from flask_migrate import Migrate
+from flask_sqlalchemy import SQLAlchemy
 from dotenv import load_dotenv
 
-from setup_db import db
+import models.models  # noqa: F401 (registers the tables in Base.metadata)
+from setup_db import Base, database_url
+
+db = SQLAlchemy(metadata=Base.metadata)
 
 
 def start_app(db):
@@ -10,20 +14,32 @@ def start_app(db):
 start_app(db) -> Flask
 This function initializes a Flask application, configure the database and returns the Flask app.
 It takes a single argument db, which is an instance of SQLAlchemy.
+The Flask app is only used by the migrations ('flask db upgrade', see .flaskenv): the bot itself
+runs on plain SQLAlchemy (see setup_db.create_db_engine) and does not import Flask.
 It pushes the app context, sets the configuration for SQLAlchemy such as the database URI and disables modification tracking.
+The database URI is taken from setup_db.database_url (the DATABASE_URL environment variable,
+e.g. a Postgres URL, or the SQLite file 'instance/database.db').
 It initializes the db with the app and creates all the tables.
 It also loads the environment variables using the load_dotenv() function.
 It returns the Flask app instance.
 Returns:
 Flask: The Flask app instance.
 """
+    load_dotenv()
     app = Flask(__name__)
     app.app_context().push()
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url()
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    
+
     db.init_app(app)
-    load_dotenv()
     db.create_all()
     migrate = Migrate(app, db, render_as_batch=True)
     return app
+
+
+def create_app() -> Flask:
+    """
+create_app() -> Flask
+This function is the application factory the flask command finds with FLASK_APP=start_app.
+"""
+    return start_app(db)
@@ -0,0 +1,36 @@
+import asyncio
+import csv
+import io
+from datetime import datetime
+
+from models.models import User
+from models.repository import init_repository, run_in_session, shutdown_repository
+from setup_db import Base, create_db_engine
+from utils.reports import export_users_csv
+
+
+def test_export_users_csv(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'database.db'}")
+    Base.metadata.create_all(engine)
+    init_repository(engine)
+    rows = [{'user_id': number, 'chat_id': number, 'username': f'user{number}', 'position': 'QA',
+             'city': 'Москва' if number % 2 else None, 'created_at': datetime(2026, 10, 1, 12, 0, 0)}
+            for number in range(1, 2501)]
+
+    async def export():
+        await run_in_session(lambda session: session.execute(User.__table__.insert(), rows))
+        return await export_users_csv()
+
+    try:
+        document = asyncio.run(export())
+    finally:
+        shutdown_repository()
+        engine.dispose()
+
+    assert isinstance(document.file, io.IOBase)
+    assert document.filename == 'users.csv'
+    lines = list(csv.reader(io.StringIO(document.file.read().decode('utf-8'), newline='')))
+    assert lines[0] == ['id', 'user_id', 'chat_id', 'username', 'position', 'city', 'created_at']
+    assert len(lines) == 2501
+    assert lines[1] == ['1', '1', '1', 'user1', 'QA', 'Москва', '2026-10-01 12:00:00']
+    assert lines[-1][5] == ''
@@ -0,0 +1,398 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+from utils.fake_telegram import FakeTelegram, FakeTelegramConfig
+from utils.webhook import use_api_server
+
+BASELINE_PATH = './benchmark_baseline.json'
+TOLERANCE = 0.3
+MIN_SECONDS_DIFFERENCE = 0.25
+MIN_RSS_DIFFERENCE_MB = 5
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NEWEST_PUBLISHED_AT = datetime(2023, 1, 20, 12, 0, 0)
+FIRST_VACANCY_ID = 80000000
+
+
+@dataclass(frozen=True)
+class Workload:
+    """
+Synthetic workload of one benchmark run: `users` subscribers spread over `positions` positions and
+`cities` cities (plus the users without a location), and `new_vacancies` new vacancies per position
+spread over the same cities.
+"""
+    name: str
+    users: int
+    positions: int = 5
+    cities: int = 10
+    new_vacancies: int = 20
+
+
+WORKLOADS = {workload.name: workload for workload in (
+    Workload('smoke', users=500, cities=3, new_vacancies=10),
+    Workload('10k', users=10_000, cities=10, new_vacancies=20),
+    Workload('100k', users=100_000, cities=20, new_vacancies=5),
+    Workload('broadcast', users=300, cities=2, new_vacancies=3),
+)}
+
+
+class RecordingBot:
+    """
+RecordingBot(latency: float = 0)
+Stand-in for aiogram.Bot that answers every call after `latency` seconds and counts the calls
+per method in `calls`.
+"""
+
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+
+    async def _call(self, method: str) -> SimpleNamespace:
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return SimpleNamespace(message_id=self.calls[method],
+                               photo=[SimpleNamespace(file_id=f'photo-{self.calls[method]}')])
+
+    async def send_photo(self, chat_id: int, photo: Any, **kwargs: Any) -> SimpleNamespace:
+        return await self._call('send_photo')
+
+    async def send_message(self, chat_id: int, text: str, **kwargs: Any) -> SimpleNamespace:
+        return await self._call('send_message')
+
+    async def send_document(self, chat_id: int, document: Any, **kwargs: Any) -> SimpleNamespace:
+        return await self._call('send_document')
+
+
+class FixtureHH:
+    """
+FixtureHH(snapshots: Dict[str, List[dict]], cities: Dict[str, str], new_vacancies: int, latency: float = 0)
+HeadHunter API replayed from the saved vacancies (vacancies_json/<position>.json): the search
+(/vacancies, with the text, area, date_from, page and per_page parameters) and the detail pages
+(/vacancies/<id>) of `new_vacancies` vacancies per position, cloned from the saved ones and spread
+over the cities (name -> HH area id). Every position also has one older vacancy, which is
+used as the watermark of the cycle. The requests are counted in `calls`.
+"""
+
+    def __init__(self, snapshots: Dict[str, List[Dict[str, Any]]], cities: Dict[str, str], new_vacancies: int,
+                 latency: float = 0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.items: Dict[str, List[Dict[str, Any]]] = {}
+        self.details: Dict[str, Dict[str, Any]] = {}
+        self.base_url = ''
+        city_names = list(cities)
+        vacancy_number = FIRST_VACANCY_ID
+        for position, snapshot in snapshots.items():
+            self.items[position] = []
+            for index in range(new_vacancies + 1):
+                city = city_names[index % len(city_names)]
+                published_at = NEWEST_PUBLISHED_AT - timedelta(minutes=index)
+                self._add(position, str(vacancy_number), snapshot[index % len(snapshot)], city, cities[city],
+                          published_at.strftime('%Y-%m-%dT%H:%M:%S+0300'))
+                vacancy_number += 1
+
+    def _add(self, position: str, hh_id: str, vacancy: Dict[str, Any], city: str, area_id: str,
+             published_at: str) -> None:
+        self.items[position].append({
+            'id': hh_id, 'published_at': published_at, 'created_at': published_at,
+            'area': {'id': area_id, 'name': city},
+            'snippet': {'responsibility': vacancy['description'], 'requirement': vacancy['requirements']},
+        })
+        experience = vacancy['experience'].replace('Можно без опыта', 'Нет опыта')
+        self.details[hh_id] = {
+            'id': hh_id, 'name': vacancy['name'], 'salary': {'from': 50000 + int(hh_id) % 50 * 1000, 'to': None,
+                                                              'currency': 'RUR'},
+            'employer': {'name': vacancy['company']}, 'created_at': published_at, 'published_at': published_at,
+            'schedule': {'name': vacancy['schedule']},
+            'experience': {'id': 'noExperience' if experience == 'Нет опыта' else 'between1And3', 'name': experience},
+            'area': {'name': city}, 'key_skills': [{'name': skill} for skill in vacancy['skills'].split(', ')],
+            'alternate_url': f'https://hh.ru/vacancy/{hh_id}',
+        }
+
+    def watermark(self, position: str) -> Dict[str, str]:
+        oldest = self.items[position][-1]
+        return {'published_at': oldest['published_at'], 'id': oldest['id']}
+
+    def position_url(self, position: str) -> str:
+        return f'{self.base_url}/vacancies?area=113&text={position}&order_by=publication_time&search_period=7'
+
+    async def search(self, request: web.Request) -> web.Response:
+        self.calls['search'] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        items = self.items.get(request.query.get('text', ''), [])
+        areas = set(request.query.getall('area', ['113']))
+        if '113' not in areas:
+            items = [item for item in items if item['area']['id'] in areas]
+        if 'date_from' in request.query:
+            items = [item for item in items if item['published_at'] >= request.query['date_from']]
+        page, per_page = int(request.query.get('page', 0)), int(request.query.get('per_page', 20))
+        found = len(items)
+        items = [dict(item, url=f"{self.base_url}/vacancies/{item['id']}")
+                 for item in items[page * per_page:(page + 1) * per_page]]
+        return web.json_response({'items': items, 'found': found, 'pages': (found + per_page - 1) // per_page,
+                                  'page': page, 'per_page': per_page})
+
+    async def detail(self, request: web.Request) -> web.Response:
+        self.calls['detail'] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        detail = self.details.get(request.match_info['id'])
+        if detail is None:
+            raise web.HTTPNotFound()
+        return web.json_response(detail)
+
+    async def start(self) -> web.AppRunner:
+        app = web.Application()
+        app.router.add_get('/vacancies', self.search)
+        app.router.add_get('/vacancies/{id}', self.detail)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = runner.addresses[0][:2]
+        self.base_url = f'http://{host}:{port}'
+        return runner
+
+
+def prepare_workdir(workdir: str, root: str = ROOT) -> None:
+    """
+prepare_workdir(workdir: str, root: str = ROOT) -> None
+This function links the media and the saved vacancies of the bot into the working directory of a run,
+so the run has its own databases, crawler state and logs. api_urls.json is written by run_cycle.
+"""
+    os.makedirs(os.path.join(workdir, 'vacancies_json'))
+    os.symlink(os.path.join(root, 'media'), os.path.join(workdir, 'media'))
+    for name in os.listdir(os.path.join(root, 'vacancies_json')):
+        if name != 'api_urls.json':
+            os.symlink(os.path.join(root, 'vacancies_json', name), os.path.join(workdir, 'vacancies_json', name))
+
+
+def pick_cities(count: int) -> Dict[str, str]:
+    """
+pick_cities(count: int) -> Dict[str, str]
+This function returns `count` cities users can choose in the bot, Moscow and Saint Petersburg first,
+with their HH area ids.
+"""
+    from keyboards import get_all_cities
+    from utils.query_planner import get_area_ids
+
+    area_ids = get_area_ids()
+    names = [name for name in dict.fromkeys(['Москва', 'Санкт-Петербург'] + get_all_cities()) if name in area_ids]
+    return {name: area_ids[name] for name in names[:count]}
+
+
+async def run_cycle(workload: Workload, hh_latency: float = 0, send_latency: float = 0,
+                    telegram: Optional[FakeTelegramConfig] = None) -> Dict[str, Any]:
+    """
+run_cycle(workload: Workload, hh_latency: float = 0, send_latency: float = 0,
+          telegram: FakeTelegramConfig = None) -> dict
+This function creates the tables (the bot leaves the schema to the migrations), subscribes the
+synthetic users, starts the HH fixture server and runs one app.vacancy_for_user cycle with a
+RecordingBot or, when `telegram` is given, with the bot itself talking to the fake Bot API (see utils.fake_telegram), flood control and blocked chats included.
+It must run in a prepared working directory (see prepare_workdir), as it imports the bot.
+Returns:
+dict: Wall time of the cycle, busy time per pipeline stage, HH and Telegram calls,
+renders and peak RSS.
+"""
+    import app
+    from models.models import User
+    from models.repository import run_in_session
+    from setup_db import Base
+    from utils.hh_client import close_session
+    from utils.metrics import hh_request_seconds, render_seconds, send_seconds, stage_seconds
+    from utils.query_planner import plan_queries
+    from utils.routing import RoutingIndex
+    from utils.utils import open_vacancies
+
+    positions = list(app.positions_name[:workload.positions])
+    cities = pick_cities(workload.cities)
+    locations = [None] + list(cities)
+    rows = [{'user_id': number, 'chat_id': number, 'username': f'user{number}',
+             'position': positions[number % len(positions)],
+             'city': locations[number // len(positions) % len(locations)]} for number in range(workload.users)]
+    Base.metadata.create_all(app.engine)
+    await run_in_session(lambda session: session.execute(User.__table__.insert(), rows))
+
+    hh = FixtureHH({position: open_vacancies(position) for position in positions}, cities,
+                   workload.new_vacancies, hh_latency)
+    runner = await hh.start()
+    with open('./vacancies_json/api_urls.json', 'w') as f:
+        json.dump([{'name': position, 'url': hh.position_url(position)} for position in positions], f)
+    routing = RoutingIndex(await app.get_subscriptions())
+    for query in plan_queries({position: hh.position_url(position) for position in positions}, routing):
+        await query.set_watermark(hh.watermark(query.position))
+
+    fake_telegram, telegram_runner = None, None
+    if telegram is None:
+        app.bot = RecordingBot(send_latency)
+    else:
+        fake_telegram = FakeTelegram(telegram)
+        telegram_runner = await fake_telegram.start()
+        use_api_server(fake_telegram.base_url)
+    started = time.perf_counter()
+    try:
+        stats = await app.vacancy_for_user(positions)
+    finally:
+        wall_seconds = time.perf_counter() - started
+        await close_session()
+        await runner.cleanup()
+        if telegram_runner is not None:
+            await app.bot.close()
+            await telegram_runner.cleanup()
+        app.shutdown_executor()
+        app.shutdown_repository()
+
+    calls = {f'hh_{kind}': count for kind, count in sorted(hh.calls.items())}
+    if fake_telegram is None:
+        calls.update((f'bot_{method}', count) for method, count in sorted(app.bot.calls.items()))
+    else:
+        calls.update((f'telegram_{call}', count) for call, count in fake_telegram.calls.items()
+                     if not call.endswith(':retry_after'))
+
+    return {
+        'workload': asdict(workload),
+        'wall_seconds': round(wall_seconds, 3),
+        'stage_seconds': {stage: round(stage_seconds.total(stage=stage), 3) for stage in
+                          ('fetch', 'normalize', 'dedupe', 'render', 'deliver', 'persist')},
+        'hh_seconds': {kind: round(hh_request_seconds.total(kind=kind), 3) for kind in ('search', 'detail')},
+        'render_seconds': round(render_seconds.total(mode='pool'), 3),
+        'send_seconds': round(send_seconds.total(), 3),
+        'calls': calls,
+        'retry_after': sum(count for call, count in fake_telegram.calls.items()
+                           if call.endswith(':retry_after')) if fake_telegram else 0,
+        'new_vacancies': sum(position_stats.new for position_stats in stats.values()),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def run_child(name: str, hh_latency: float, send_latency: float,
+              telegram: Optional[FakeTelegramConfig] = None) -> Dict[str, Any]:
+    """
+run_child(name: str, hh_latency: float, send_latency: float, telegram: FakeTelegramConfig = None) -> dict
+This function runs the workload in a new temporary working directory, with an SQLite database of
+its own. With the RecordingBot the delivery rate limits are lifted, so the run measures the bot and
+not the limits; with the fake Bot API they are kept, as the point is to test them.
+"""
+    workdir = tempfile.mkdtemp(prefix='hh-benchmark-')
+    prepare_workdir(workdir)
+    sys.path.insert(0, ROOT)
+    os.environ.update(DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'database.db')}", DELIVERY_MODE='local',
+                      METRICS_PORT='0', BOT_MODE='polling', TELEGRAM_API_URL='')
+    if telegram is None:
+        os.environ.update(DELIVERY_GLOBAL_RATE='1000000', DELIVERY_PER_CHAT_RATE='1000000')
+    os.environ.setdefault('TOKEN', '123456:benchmark')
+    os.chdir(workdir)
+    try:
+        return asyncio.run(run_cycle(WORKLOADS[name], hh_latency, send_latency, telegram))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_workload(name: str, hh_latency: float = 0, send_latency: float = 0, fake_telegram: bool = False,
+                 blocked_share: float = 0) -> Dict[str, Any]:
+    """
+run_workload(name: str, hh_latency: float = 0, send_latency: float = 0, fake_telegram: bool = False,
+             blocked_share: float = 0) -> dict
+This function runs the workload in a separate process, so its peak RSS and its metrics are its own.
+"""
+    command = [sys.executable, '-m', 'utils.benchmark', '--child', name,
+               '--hh-latency', str(hh_latency), '--send-latency', str(send_latency),
+               '--blocked-share', str(blocked_share)] + (['--fake-telegram'] if fake_telegram else [])
+    process = subprocess.run(command, stdout=subprocess.PIPE, check=True, cwd=ROOT)
+    return json.loads(process.stdout.decode('utf-8').splitlines()[-1])
+
+
+def compare(result: Dict[str, Any], baseline: Optional[Dict[str, Any]], tolerance: float = TOLERANCE) -> List[str]:
+    """
+compare(result: dict, baseline: Optional[dict], tolerance: float = TOLERANCE) -> List[str]
+This function returns the regressions of the result against the baseline of the same workload:
+the times and the peak RSS more than `tolerance` above the baseline (and more than MIN_SECONDS_DIFFERENCE
+or MIN_RSS_DIFFERENCE_MB, so the noise of short stages is not reported), and any change in the number of calls.
+"""
+    if baseline is None:
+        return []
+    if baseline['workload'] != result['workload']:
+        return [f"нагрузка изменилась: {baseline['workload']} -> {result['workload']}"]
+    checks = [('wall_seconds', result['wall_seconds'], baseline['wall_seconds'], MIN_SECONDS_DIFFERENCE),
+              ('peak_rss_mb', result['peak_rss_mb'], baseline['peak_rss_mb'], MIN_RSS_DIFFERENCE_MB)]
+    checks += [(f'stage_seconds.{stage}', seconds, baseline['stage_seconds'].get(stage, 0), MIN_SECONDS_DIFFERENCE)
+               for stage, seconds in result['stage_seconds'].items()]
+    regressions = [f'{name}: {value} (было {old})' for name, value, old, min_difference in checks
+                   if value > old * (1 + tolerance) and value - old > min_difference]
+    for name in sorted(set(result['calls']) | set(baseline['calls'])):
+        if result['calls'].get(name, 0) != baseline['calls'].get(name, 0):
+            regressions.append(f"calls.{name}: {result['calls'].get(name, 0)} (было {baseline['calls'].get(name, 0)})")
+    return regressions
+
+
+def summary(result: Dict[str, Any]) -> str:
+    stages = ', '.join(f'{stage} {seconds} с' for stage, seconds in result['stage_seconds'].items())
+    calls = ', '.join(f'{name} {count}' for name, count in result['calls'].items())
+    return (f"{result['workload']['name']}: {result['wall_seconds']} с, новых вакансий {result['new_vacancies']}, "
+            f"пик RSS {result['peak_rss_mb']} МБ\n  этапы: {stages}\n  вызовы: {calls}, 429: {result['retry_after']}\n"
+            f"  HH {result['hh_seconds']}, рендер {result['render_seconds']} с, отправка {result['send_seconds']} с")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Run vacancy_for_user end to end against the HH fixtures and a '
+                                                 'recording bot and compare the results with the baseline')
+    parser.add_argument('--workloads', default='smoke,10k', help=f'comma separated, out of {", ".join(WORKLOADS)}')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--hh-latency', type=float, default=0, help='seconds per HH request')
+    parser.add_argument('--send-latency', type=float, default=0, help='seconds per Telegram call')
+    parser.add_argument('--fake-telegram', action='store_true',
+                        help="send through the fake Bot API with Telegram's rate limits instead of the recording bot")
+    parser.add_argument('--blocked-share', type=float, default=0,
+                        help='with --fake-telegram, share of the chats that blocked the bot')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.child:
+        telegram = None
+        if arguments.fake_telegram:
+            telegram = FakeTelegramConfig(blocked_share=arguments.blocked_share, latency=arguments.send_latency)
+        result = run_child(arguments.child, arguments.hh_latency, arguments.send_latency, telegram)
+        sys.stdout.write(json.dumps(result, ensure_ascii=False) + '\n')
+        return 0
+
+    baseline: Dict[str, Any] = {}
+    if os.path.exists(arguments.baseline):
+        with open(arguments.baseline) as f:
+            baseline = json.load(f)
+    results, failed = {}, False
+    for name in arguments.workloads.split(','):
+        key = f'{name}-telegram' if arguments.fake_telegram else name
+        result = results[key] = run_workload(name, arguments.hh_latency, arguments.send_latency,
+                                             arguments.fake_telegram, arguments.blocked_share)
+        print(summary(result))
+        for regression in compare(result, baseline.get(key), arguments.tolerance):
+            failed = True
+            print(f'  РЕГРЕССИЯ {regression}')
+    if arguments.save:
+        baseline.update(results)
+        with open(arguments.baseline, 'w') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f'Сохранено в {arguments.baseline}')
+    return 1 if failed and not arguments.save else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
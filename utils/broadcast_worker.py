@@ -0,0 +1,109 @@
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from aiogram import Bot
+from aiogram.utils import exceptions
+
+from utils.change_image import shutdown_executor
+from utils.delivery import DeliveryScheduler
+from utils.job_queue import DELIVERY_SHARDS, JobQueue, LeasedJob, SharedTokenBucket
+from utils.vacancy_cards import VacancyCardCache
+from utils.webhook import use_api_server
+
+POLL_INTERVAL = 1.0
+LEASE_LIMIT = 10
+MAX_CARDS = 1000
+
+
+async def deliver_jobs(queue: JobQueue, jobs: List[LeasedJob], bot: Bot, cards: VacancyCardCache,
+                       bucket: SharedTokenBucket) -> None:
+    """
+deliver_jobs(queue: JobQueue, jobs: List[LeasedJob], bot: Bot, cards: VacancyCardCache,
+             bucket: SharedTokenBucket) -> None
+This function sends the leased jobs with a DeliveryScheduler that takes its global tokens
+from the shared bucket, and completes every job with its result.
+"""
+    sent: Counter = Counter()
+    retries: Counter = Counter()
+    latencies: Dict[int, List[float]] = defaultdict(list)
+
+    async def send(chat_id: int, job: LeasedJob) -> None:
+        try:
+            await cards.send(bot, chat_id, job.vacancy)
+        except exceptions.RetryAfter:
+            retries[job.id] += 1
+            raise
+        sent[job.id] += 1
+        latencies[job.id].append(round(time.time() - job.created_at, 3))
+
+    scheduler = DeliveryScheduler(send, global_bucket=bucket)
+    scheduler.start()
+    for job in jobs:
+        for chat_id in job.chat_ids:
+            scheduler.submit(chat_id, job)
+    report = await scheduler.join()
+
+    for job in jobs:
+        dead = {chat_id: report.dead[chat_id] for chat_id in job.chat_ids if chat_id in report.dead}
+        result = {'sent': sent[job.id], 'failed': len(job.chat_ids) - sent[job.id] - len(dead),
+                  'retries': retries[job.id], 'dead': dead, 'latencies': latencies[job.id]}
+        await queue.run(queue.complete, job.id, result)
+    logging.info(f'Задач {len(jobs)}: {report.summary()}')
+
+
+async def run_worker(queue: JobQueue, shards: Iterable[int], bot: Bot, stop: Optional[asyncio.Event] = None,
+                     name: Optional[str] = None) -> None:
+    """
+run_worker(queue: JobQueue, shards: Iterable[int], bot: Bot, stop: asyncio.Event = None, name: str = None) -> None
+This function leases and sends the delivery jobs of the shards until `stop` is set.
+The jobs being sent when it is set are finished first.
+"""
+    shards = list(shards)
+    name = name or f'{socket.gethostname()}:{os.getpid()}'
+    stop = stop or asyncio.Event()
+    bucket = SharedTokenBucket(queue)
+    cards = VacancyCardCache()
+    logging.info(f'Обработчик рассылки {name}, шарды {shards}')
+    while not stop.is_set():
+        jobs = await queue.run(queue.lease, name, shards, LEASE_LIMIT)
+        if not jobs:
+            try:
+                await asyncio.wait_for(stop.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        if cards.renders > MAX_CARDS:
+            cards = VacancyCardCache()
+        await deliver_jobs(queue, jobs, bot, cards, bucket)
+
+
+async def main(shards: List[int]) -> None:
+    use_api_server()
+    bot = Bot(token=os.getenv('TOKEN'))
+    queue = JobQueue()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop.set)
+    try:
+        await run_worker(queue, shards, bot, stop)
+    finally:
+        await bot.close()
+        queue.close()
+        shutdown_executor()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Send the queued vacancy broadcasts')
+    parser.add_argument('--shards', default=','.join(map(str, range(DELIVERY_SHARDS))),
+                        help=f'comma separated shards to serve, out of DELIVERY_SHARDS={DELIVERY_SHARDS}')
+    arguments = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    asyncio.run(main([int(shard) for shard in arguments.shards.split(',')]))
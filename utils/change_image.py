@@ -1,53 +1,120 @@
-import re
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
 from io import BytesIO
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 from PIL import Image
 from PIL import ImageDraw
 from PIL import ImageFont
-from aiogram.types import InputFile
 
+from utils.metrics import render_seconds
 
-def add_text_to_image(image_path='./media/1.jpg', vacancy_name: str = None, company_name: str = None,
-                      salary: str = None) -> InputFile:
+TEMPLATE_PATH = './media/1.jpg'
+VACANCY_FONT_PATH = './media/vacancy_font.ttf'
+COMPANY_FONT_PATH = './media/company_font.ttf'
+RENDER_EXECUTOR = os.getenv('RENDER_EXECUTOR', 'process')
+RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', min(4, os.cpu_count() or 1)))
+
+_executor: Optional[Executor] = None
+
+
+@lru_cache(maxsize=None)
+def load_template(image_path: str = TEMPLATE_PATH) -> Image.Image:
     """
-add_text_to_image(image_path='./media/1.jpg', vacancy_name: str = None, company_name: str = None,
-salary: str = None) -> InputFile
-This function opens an image, adds text to it, saves it and returns the modified image as InputFile object.
-The function takes in 3 optional parameters:
-- image_path: The filepath of the image to be modified, default is './media/1.jpg'
-- vacancy_name: name of the vacancy, the text to be added to the image.
-- company_name: name of the company, the text to be added to the image.
-- salary: salary of the vacancy, the text to be added to the image.
-
-The function uses the python Imaging Library (PIL) to open the image and draw on it.
-It uses 3 different fonts to write the texts on the image, './media/vacancy_font.ttf', './media/company_font.ttf' and './media/salary_font.ttf'
-The text is written on the specified positions on the image (80, 130), (80, 230) and (80, 850) respectively for vacancy_name, company_name and salary.
-The modified image is then saved in './media/saved_images/' directory with the name of the image as save_name.
-The modified image is then read as binary and returned as InputFile object.
-Returns:
-InputFile: The binary content of the modified image wrapped as a InputFile object.
+load_template(image_path: str = TEMPLATE_PATH) -> Image.Image
+This function opens and decodes the card template once; every render works on a copy of it.
 """
-
     image = Image.open(image_path)
+    image.load()
+    return image
 
-    draw = ImageDraw.Draw(image)
 
-    save_name = vacancy_name.split(' ')[0:2]
-    save_name = " ".join(save_name) + '-' + company_name
-    save_name = re.sub(r'/', '', save_name)
-    save_name = re.sub(r',', '', save_name)
+@lru_cache(maxsize=None)
+def load_fonts() -> Tuple[ImageFont.FreeTypeFont, ImageFont.FreeTypeFont, ImageFont.FreeTypeFont]:
+    """
+load_fonts() -> Tuple[FreeTypeFont, FreeTypeFont, FreeTypeFont]
+This function parses the vacancy, company and salary fonts once.
+"""
+    vacancy_font = ImageFont.truetype(font=VACANCY_FONT_PATH, size=80)
+    company_font = ImageFont.truetype(font=COMPANY_FONT_PATH, size=80)
+    salary_font = ImageFont.truetype(font=COMPANY_FONT_PATH, size=50)
+    return vacancy_font, company_font, salary_font
 
-    vacancy_font = ImageFont.truetype(font='./media/vacancy_font.ttf', size=80)
-    company_font = ImageFont.truetype(font='./media/company_font.ttf', size=80)
-    salary_font = ImageFont.truetype(font='./media/company_font.ttf', size=50)
 
+def render_vacancy_image(vacancy_name: str = None, company_name: str = None, salary: str = None,
+                         image_path: str = TEMPLATE_PATH) -> bytes:
+    """
+render_vacancy_image(vacancy_name: str = None, company_name: str = None, salary: str = None,
+image_path: str = TEMPLATE_PATH) -> bytes
+This function draws the vacancy name, company name and salary on a copy of the preloaded template
+at (80, 130), (80, 230) and (80, 850) and encodes the card as JPEG straight into memory.
+Returns:
+bytes: The JPEG image.
+"""
+    image = load_template(image_path).copy()
+    vacancy_font, company_font, salary_font = load_fonts()
+
+    draw = ImageDraw.Draw(image)
     draw.text(xy=(80, 130), text=vacancy_name, font=vacancy_font, fill=(0, 0, 0))
     draw.text(xy=(80, 230), text=company_name, font=company_font, fill=(0, 0, 0))
     draw.text(xy=(80, 850), text=salary, font=salary_font, fill=(0, 0, 0))
 
-    image.save(f'./media/saved_images/{save_name}.jpg')
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def _preload() -> None:
+    load_template()
+    load_fonts()
 
-    with open(f'./media/saved_images/{save_name}.jpg', 'rb') as file:
-        photo = InputFile(BytesIO(file.read()), "image.jpg")
 
-    return photo
+def get_executor() -> Executor:
+    """
+get_executor() -> Executor
+This function returns the pool the cards are rendered in: a process pool by default, so
+renders run in parallel on several cores, or a thread pool when RENDER_EXECUTOR=thread.
+Every worker loads the template and the fonts when it starts.
+"""
+    global _executor
+    if _executor is None:
+        if RENDER_EXECUTOR == 'thread':
+            _preload()
+            _executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS)
+        else:
+            _executor = ProcessPoolExecutor(max_workers=RENDER_WORKERS, initializer=_preload)
+    return _executor
+
+
+def shutdown_executor() -> None:
+    """
+shutdown_executor() -> None
+This function stops the render pool, if it was started.
+"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+    _executor = None
+
+
+async def render_vacancy_image_async(vacancy_name: str, company_name: str, salary: str) -> bytes:
+    """
+render_vacancy_image_async(vacancy_name: str, company_name: str, salary: str) -> bytes
+This function runs render_vacancy_image() in the render pool, so PIL never blocks the event loop.
+The time it takes, including the wait for a free worker, is recorded in the render_seconds metric.
+"""
+    loop = asyncio.get_running_loop()
+    with render_seconds.time(mode='pool'):
+        return await loop.run_in_executor(get_executor(), render_vacancy_image, vacancy_name, company_name, salary)
+
+
+async def render_batch(vacancies: Iterable[Dict[str, Any]]) -> List[bytes]:
+    """
+render_batch(vacancies: Iterable[dict]) -> List[bytes]
+This function renders the cards of several vacancies in parallel in the render pool and
+returns the JPEG images in the same order.
+"""
+    return await asyncio.gather(*(render_vacancy_image_async(vacancy['name'], vacancy['company'], vacancy['salary'])
+                                  for vacancy in vacancies))
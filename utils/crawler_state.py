@@ -0,0 +1,142 @@
+import asyncio
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional, TypeVar
+
+STATE_DB_PATH = './instance/crawler.db'
+
+T = TypeVar('T')
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS watermarks ('
+    'position TEXT PRIMARY KEY, '
+    'published_at TEXT NOT NULL, '
+    'vacancy_id TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS vacancy_details ('
+    'vacancy_id TEXT PRIMARY KEY, '
+    'stamp TEXT, '
+    'etag TEXT, '
+    'last_modified TEXT, '
+    'body TEXT NOT NULL, '
+    'fetched_at REAL NOT NULL, '
+    'accessed_at REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS ix_vacancy_details_accessed_at ON vacancy_details (accessed_at)',
+    'CREATE TABLE IF NOT EXISTS seen_vacancies ('
+    'position TEXT NOT NULL, '
+    'vacancy_id TEXT NOT NULL, '
+    'seen_at REAL NOT NULL, '
+    'PRIMARY KEY (position, vacancy_id))',
+    'CREATE INDEX IF NOT EXISTS ix_seen_vacancies_position_seen_at ON seen_vacancies (position, seen_at)',
+)
+
+_connection: Optional[sqlite3.Connection] = None
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def connect() -> sqlite3.Connection:
+    """
+connect() -> sqlite3.Connection
+This function opens a new connection to the crawler state database './instance/crawler.db'
+in WAL mode and creates all the tables.
+"""
+    os.makedirs(os.path.dirname(STATE_DB_PATH), exist_ok=True)
+    connection = sqlite3.connect(STATE_DB_PATH, check_same_thread=False)
+    connection.row_factory = sqlite3.Row
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    for statement in SCHEMA:
+        connection.execute(statement)
+    connection.commit()
+    return connection
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+get_connection() -> sqlite3.Connection
+This function returns the connection to the crawler state database './instance/crawler.db'.
+The database keeps the data the crawler needs between runs (publication watermarks,
+cached vacancy detail pages, ids of the vacancies already sent) and is separate from
+the users database. It is opened once (see connect) on first use.
+The connection is only used on the crawler state thread: call it from functions passed to run().
+Returns:
+sqlite3.Connection: The shared connection.
+"""
+    global _connection
+    if _connection is None:
+        _connection = connect()
+    return _connection
+
+
+async def run(func: Callable[..., T], *args: Any) -> T:
+    """
+run(func: Callable[..., T], *args) -> T
+This function runs func(*args) on the crawler state thread and returns its result.
+All the work with the crawler state database (the watermarks, utils.detail_cache and
+utils.seen_index) goes through this single thread and its connection, so the event loop never
+waits for SQLite and the writes never compete for the database lock.
+"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='crawler-state')
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+def close() -> None:
+    """
+close() -> None
+This function waits for the pending writes and closes the crawler state connection.
+"""
+    global _connection, _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    if _connection is not None:
+        _connection.close()
+        _connection = None
+
+
+def read_watermarks(keys: Iterable[str]) -> Dict[str, Optional[Dict[str, str]]]:
+    """
+read_watermarks(keys: Iterable[str]) -> Dict[str, Optional[dict]]
+This function returns the publication watermark of every key (a position or a position area):
+the publication time and the HeadHunter id of the newest vacancy that was already processed,
+or None if it was never crawled. It runs on the crawler state thread, see get_watermarks.
+"""
+    watermarks: Dict[str, Optional[Dict[str, str]]] = {}
+    for key in keys:
+        row = get_connection().execute('SELECT published_at, vacancy_id FROM watermarks WHERE position = ?',
+                                       (key,)).fetchone()
+        watermarks[key] = None if row is None else {'published_at': row['published_at'], 'id': row['vacancy_id']}
+    return watermarks
+
+
+def write_watermarks(keys: Iterable[str], watermark: Dict[str, str]) -> None:
+    """
+write_watermarks(keys: Iterable[str], watermark: dict) -> None
+This function stores the publication watermark for every key in one transaction.
+It runs on the crawler state thread, see set_watermarks.
+"""
+    connection = get_connection()
+    connection.executemany('INSERT INTO watermarks (position, published_at, vacancy_id) VALUES (?, ?, ?) '
+                           'ON CONFLICT(position) DO UPDATE SET '
+                           'published_at = excluded.published_at, vacancy_id = excluded.vacancy_id',
+                           [(key, watermark['published_at'], watermark['id']) for key in keys])
+    connection.commit()
+
+
+async def get_watermarks(keys: Iterable[str]) -> Dict[str, Optional[Dict[str, str]]]:
+    """
+get_watermarks(keys: Iterable[str]) -> Dict[str, Optional[dict]]
+This function returns the publication watermarks of the keys (see read_watermarks).
+"""
+    return await run(read_watermarks, list(keys))
+
+
+async def set_watermarks(keys: Iterable[str], watermark: Dict[str, str]) -> None:
+    """
+set_watermarks(keys: Iterable[str], watermark: dict) -> None
+This function stores the publication watermark for every key.
+The watermark should only be moved forward after the vacancies it covers were sent and saved.
+"""
+    await run(write_watermarks, list(keys), watermark)
@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import os
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram.utils import exceptions
+
+from utils.metrics import delivery_queue_depth, send_errors, send_seconds
+
+GLOBAL_RATE = float(os.getenv('DELIVERY_GLOBAL_RATE', 30))
+PER_CHAT_RATE = float(os.getenv('DELIVERY_PER_CHAT_RATE', 1))
+WORKERS = int(os.getenv('DELIVERY_WORKERS', 10))
+MAX_RETRIES = 5
+
+DEAD_CHAT_ERRORS = {
+    exceptions.BotBlocked: 'blocked',
+    exceptions.UserDeactivated: 'deactivated',
+    exceptions.ChatNotFound: 'chat_not_found',
+}
+
+
+class TokenBucket:
+    """
+TokenBucket(rate: float, capacity: float = None)
+Token bucket rate limiter: `rate` tokens are added per second, up to `capacity`
+(by default one second worth of tokens). acquire() waits until a token is available
+and the bucket is not paused (see pause()).
+"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """
+pause(seconds: float) -> None
+This function stops handing out tokens for `seconds`, e.g. after a flood control error.
+"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        delay = self.paused_until - time.monotonic()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.paused_until - time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class DeliveryReport:
+    """
+Counters of one broadcast: sent and failed messages, RetryAfter retries, dead chats
+(chat_id -> 'blocked' / 'deactivated' / 'chat_not_found') and the delivery latency
+(from submit() to the successful send) of every sent message.
+"""
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    dead: Dict[int, str] = field(default_factory=dict)
+    latencies: List[float] = field(default_factory=list)
+    started_at: float = field(default_factory=time.monotonic)
+    finished_at: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        return self.sent / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def dead_counts(self) -> Dict[str, int]:
+        """
+        Number of dead chats per reason, e.g. {'blocked': 12, 'deactivated': 1}.
+        """
+        return dict(Counter(self.dead.values()))
+
+    def latency_percentile(self, percentile: float) -> float:
+        if not self.latencies:
+            return 0.0
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile))]
+
+    def summary(self) -> str:
+        return (f'отправлено {self.sent}, ошибок {self.failed}, повторов {self.retries}, '
+                f'мертвых чатов {len(self.dead)} {self.dead_counts}, {self.elapsed:.1f} с, {self.throughput:.1f} сообщ/с, '
+                f'задержка p50 {self.latency_percentile(0.5):.2f} с, p95 {self.latency_percentile(0.95):.2f} с')
+
+
+@dataclass
+class DeliveryJob:
+    chat_id: int
+    payload: Any
+    submitted_at: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+
+
+class DeliveryScheduler:
+    """
+DeliveryScheduler(send, workers: int = WORKERS, global_rate: float = GLOBAL_RATE,
+                  per_chat_rate: float = PER_CHAT_RATE, max_retries: int = MAX_RETRIES, global_bucket=None)
+Queue of messages to send and a pool of workers that send them with `send(chat_id, payload)`.
+After every successful send, on_sent(chat_id, payload) is called if it is set.
+
+Every send takes a token from the global bucket (Telegram allows about 30 messages per second
+per bot) and from the bucket of the chat. A RetryAfter error pauses the global bucket, and so
+all the workers, for the requested time and puts the message back in the queue. The global
+bucket can be shared by several processes (see utils.job_queue.SharedTokenBucket).
+BotBlocked, UserDeactivated and ChatNotFound mark the chat as dead: it is reported in
+DeliveryReport.dead and the rest of its messages are dropped. Any other Telegram error is
+logged and counted as failed.
+
+Usage: start(), submit() the messages, then join() to wait for the queue and get the report.
+"""
+
+    def __init__(self, send: Callable[[int, Any], Awaitable[Any]], workers: int = WORKERS,
+                 global_rate: float = GLOBAL_RATE, per_chat_rate: float = PER_CHAT_RATE,
+                 max_retries: int = MAX_RETRIES, global_bucket: Optional[TokenBucket] = None):
+        self.send = send
+        self.workers = workers
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max_retries
+        self.global_bucket = global_bucket or TokenBucket(global_rate, capacity=1)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.report = DeliveryReport()
+        self.on_sent: Optional[Callable[[int, Any], None]] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        self.report = DeliveryReport()
+        delivery_queue_depth.track(self.queue.qsize)
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, chat_id: int, payload: Any) -> None:
+        self.queue.put_nowait(DeliveryJob(chat_id, payload))
+
+    async def join(self) -> DeliveryReport:
+        await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.report.finished_at = time.monotonic()
+        return self.report
+
+    async def _worker(self) -> None:
+        while True:
+            job: DeliveryJob = await self.queue.get()
+            try:
+                await self._deliver(job)
+            except Exception as e:
+                self.report.failed += 1
+                logging.info(f'Не удалось отправить сообщение в чат {job.chat_id}: {e!r}')
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, job: DeliveryJob) -> None:
+        if job.chat_id in self.report.dead:
+            return
+        if job.chat_id not in self.chat_buckets:
+            self.chat_buckets[job.chat_id] = TokenBucket(self.per_chat_rate, capacity=1)
+        await self.chat_buckets[job.chat_id].acquire()
+        await self.global_bucket.acquire()
+        try:
+            await self._send(job)
+        except exceptions.RetryAfter as e:
+            self.global_bucket.pause(e.timeout)
+            job.attempts += 1
+            if job.attempts > self.max_retries:
+                raise
+            self.report.retries += 1
+            logging.info(f'Flood control, пауза {e.timeout} с')
+            self.queue.put_nowait(job)
+        except tuple(DEAD_CHAT_ERRORS) as e:
+            self.report.dead[job.chat_id] = next(reason for error, reason in DEAD_CHAT_ERRORS.items()
+                                                 if isinstance(e, error))
+        else:
+            self.report.sent += 1
+            self.report.latencies.append(time.monotonic() - job.submitted_at)
+            if self.on_sent is not None:
+                self.on_sent(job.chat_id, job.payload)
+
+    async def _send(self, job: DeliveryJob) -> None:
+        started = time.perf_counter()
+        try:
+            await self.send(job.chat_id, job.payload)
+        except Exception as e:
+            send_errors.inc(error=type(e).__name__)
+            raise
+        finally:
+            send_seconds.observe(time.perf_counter() - started)
@@ -0,0 +1,140 @@
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.crawler_state import get_connection, run
+from utils.hh_client import fetch_conditional, gather_limited
+
+DETAIL_TTL = 3 * 24 * 3600
+MAX_ENTRIES = 20000
+
+
+class DetailCache:
+    """
+DetailCache(ttl: int = DETAIL_TTL, max_entries: int = MAX_ENTRIES)
+On-disk cache of HeadHunter vacancy detail pages, keyed by the HH vacancy id and stored in
+the crawler state database.
+
+A cached page is used without any request while it is younger than `ttl` seconds and the
+search result still has the same updated_at / published_at stamp. Otherwise the page is
+revalidated with a conditional request (If-None-Match / If-Modified-Since) when the API sent
+an ETag or Last-Modified header, and downloaded again when it did not.
+When the cache grows over `max_entries` pages, the least recently used ones are evicted.
+The database work runs on the crawler state thread (see utils.crawler_state.run), so the
+pipeline (which asks for one vacancy at a time) does not wait for SQLite on the event loop.
+
+The hits, revalidated, misses and errors counters show how many HH calls were saved.
+"""
+
+    def __init__(self, ttl: int = DETAIL_TTL, max_entries: int = MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.counters = {'hits': 0, 'revalidated': 0, 'misses': 0, 'errors': 0}
+
+    @staticmethod
+    def stamp(item: Dict[str, Any]) -> Optional[str]:
+        """
+stamp(item: dict) -> Optional[str]
+This function returns the change stamp of a search result: updated_at when the API sends it,
+otherwise published_at.
+"""
+        return item.get('updated_at') or item.get('published_at')
+
+    async def get_details(self, items: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+        """
+get_details(items: List[dict]) -> List[Optional[dict]]
+This function returns the detail page of every search result, in the same order, using the
+cache where possible. The pages that had to be requested are fetched concurrently.
+None is returned for the pages that could not be loaded.
+"""
+        cached = await run(self._load, [str(item['id']) for item in items])
+        now = time.time()
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        to_fetch = []
+        for index, item in enumerate(items):
+            row = cached.get(str(item['id']))
+            if row is not None and row['stamp'] == self.stamp(item) and now - row['fetched_at'] < self.ttl:
+                self.counters['hits'] += 1
+                results[index] = json.loads(row['body'])
+            else:
+                to_fetch.append((index, item, row))
+        touched = [str(item['id']) for index, item in enumerate(items) if results[index] is not None]
+
+        fetched = await gather_limited(self._fetch, to_fetch, describe=lambda job: job[1]['url'])
+        rows = []
+        for (index, item, _), result in zip(to_fetch, fetched):
+            if result is None:
+                self.counters['errors'] += 1
+                continue
+            body, validators = result
+            results[index] = body
+            rows.append((str(item['id']), self.stamp(item), validators.get('ETag'), validators.get('Last-Modified'),
+                         json.dumps(body, ensure_ascii=False)))
+        await run(self._save, touched, rows, now)
+        return results
+
+    async def _fetch(self, job: tuple) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        _, item, row = job
+        if row is not None:
+            status, body, validators = await fetch_conditional(item['url'], row['etag'], row['last_modified'])
+        else:
+            status, body, validators = await fetch_conditional(item['url'])
+        if status == 304:
+            self.counters['revalidated'] += 1
+            body = json.loads(row['body'])
+            validators = {'ETag': row['etag'], 'Last-Modified': row['last_modified'], **validators}
+        else:
+            self.counters['misses'] += 1
+        return body, validators
+
+    def _load(self, vacancy_ids: List[str]) -> Dict[str, Any]:
+        if not vacancy_ids:
+            return {}
+        placeholders = ', '.join('?' * len(vacancy_ids))
+        rows = get_connection().execute(f'SELECT * FROM vacancy_details WHERE vacancy_id IN ({placeholders})',
+                                        vacancy_ids).fetchall()
+        return {row['vacancy_id']: row for row in rows}
+
+    def _save(self, touched: List[str], rows: List[tuple], now: float) -> None:
+        if not touched and not rows:
+            return
+        connection = get_connection()
+        connection.executemany('UPDATE vacancy_details SET accessed_at = ? WHERE vacancy_id = ?',
+                               [(now, vacancy_id) for vacancy_id in touched])
+        connection.executemany('INSERT OR REPLACE INTO vacancy_details '
+                               '(vacancy_id, stamp, etag, last_modified, body, fetched_at, accessed_at) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?)', [(*row, now, now) for row in rows])
+        connection.commit()
+
+    async def evict(self) -> None:
+        """
+evict() -> None
+This function drops the least recently used pages over max_entries. It is called once per cycle.
+"""
+        await run(self._evict)
+
+    def _evict(self) -> None:
+        connection = get_connection()
+        connection.execute('DELETE FROM vacancy_details WHERE vacancy_id IN ('
+                           'SELECT vacancy_id FROM vacancy_details ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+                           (self.max_entries,))
+        connection.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """
+stats() -> dict
+This function returns the cache counters and the number of HH requests they saved
+(hits skip the request, revalidated pages only cost a body-less 304 response).
+"""
+        return {**self.counters, 'saved_requests': self.counters['hits']}
+
+    def reset_stats(self) -> None:
+        """
+reset_stats() -> None
+This function sets all the counters back to zero, e.g. at the start of a cycle.
+"""
+        for key in self.counters:
+            self.counters[key] = 0
+
+
+detail_cache = DetailCache()
@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import json
+import math
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+from utils.webhook import load_updates
+
+SEND_METHODS = ('sendPhoto', 'sendMessage', 'sendDocument')
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+
+
+@dataclass
+class FakeTelegramConfig:
+    """
+Behaviour of the fake Bot API: Telegram's limits (about 30 messages per second per bot and
+one per second per chat), the share of chats that blocked the bot (chosen from the chat id
+and the seed, so the same chats are blocked on every run) and the latency of every call.
+"""
+    global_rate: float = 30
+    per_chat_rate: float = 1
+    blocked_share: float = 0.0
+    latency: float = 0.0
+    seed: int = 0
+
+
+class RateWindow:
+    """
+RateWindow(rate: float)
+Token bucket that does not wait: take() returns 0 when a token was taken, or the seconds
+until the next one, which the fake server sends back as retry_after.
+"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class FakeTelegram:
+    """
+FakeTelegram(config: FakeTelegramConfig = None)
+Local stand-in for the Telegram Bot API (https://api.telegram.org/bot<token>/<method>) for load tests
+of the broadcast. Point the bot at it with TELEGRAM_API_URL (see utils.webhook.use_api_server).
+
+sendPhoto, sendMessage and sendDocument answer after config.latency seconds with a message, unless:
+    - the chat is one of the blocked ones: 403 "Forbidden: bot was blocked by the user";
+    - the global or the chat rate is exceeded: 429 with parameters.retry_after, like Telegram's
+      flood control. Exceeding the global rate locks every send out for retry_after seconds.
+deleteMessage, editMessageText and answerCallbackQuery always succeed, getUpdates long polls the updates added with add_updates()
+(or POSTed as JSON to /fake/updates), getMe, getWebhookInfo, setWebhook and deleteWebhook are answered
+so the bot can start. Every call is counted in `calls` by method and outcome, GET /fake/stats returns them.
+"""
+
+    def __init__(self, config: Optional[FakeTelegramConfig] = None):
+        self.config = config or FakeTelegramConfig()
+        self.calls: Counter = Counter()
+        self.blocked_chats: set = set()
+        self.global_window = RateWindow(self.config.global_rate)
+        self.chat_windows: Dict[int, RateWindow] = {}
+        self.locked_until = 0.0
+        self.message_id = 0
+        self.updates: List[Dict[str, Any]] = []
+        self.update_id = 0
+        self._new_updates = asyncio.Event()
+        self.base_url = ''
+
+    def is_blocked(self, chat_id: int) -> bool:
+        share = zlib.crc32(f'{self.config.seed}:{chat_id}'.encode()) / 2 ** 32
+        return share < self.config.blocked_share
+
+    def add_updates(self, updates: List[Dict[str, Any]]) -> None:
+        for update in updates:
+            self.update_id += 1
+            self.updates.append(dict(update, update_id=self.update_id))
+        self._new_updates.set()
+
+    @staticmethod
+    def _ok(result: Any) -> web.Response:
+        return web.json_response({'ok': True, 'result': result})
+
+    @staticmethod
+    def _error(status: int, description: str, **parameters: Any) -> web.Response:
+        body = {'ok': False, 'error_code': status, 'description': description}
+        if parameters:
+            body['parameters'] = parameters
+        return web.json_response(body, status=status)
+
+    def _flood_control(self, chat_id: int) -> Optional[web.Response]:
+        now = time.monotonic()
+        if now < self.locked_until:
+            return self._retry_after(self.locked_until - now)
+        wait = self.global_window.take()
+        if wait:
+            self.locked_until = now + math.ceil(wait)
+            return self._retry_after(wait)
+        window = self.chat_windows.setdefault(chat_id, RateWindow(self.config.per_chat_rate))
+        wait = window.take()
+        if wait:
+            return self._retry_after(wait)
+        return None
+
+    def _retry_after(self, wait: float) -> web.Response:
+        retry_after = max(1, math.ceil(wait))
+        return self._error(429, f'Too Many Requests: retry after {retry_after}', retry_after=retry_after)
+
+    def _message(self, method: str, chat_id: int, data: Dict[str, Any]) -> Dict[str, Any]:
+        self.message_id += 1
+        message = {'message_id': self.message_id, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'}}
+        if method == 'sendPhoto':
+            file_id = data['photo'] if isinstance(data.get('photo'), str) else f'photo-{self.message_id}'
+            message['photo'] = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 800, 'height': 600}]
+            message['caption'] = data.get('caption', '')
+        elif method == 'sendDocument':
+            file_id = data['document'] if isinstance(data.get('document'), str) else f'document-{self.message_id}'
+            message['document'] = {'file_id': file_id, 'file_unique_id': file_id}
+        else:
+            message['text'] = data.get('text', '')
+        return message
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        data = dict(await request.post())
+        if self.config.latency:
+            await asyncio.sleep(self.config.latency)
+
+        if method in SEND_METHODS:
+            chat_id = int(data.get('chat_id', 0))
+            if self.is_blocked(chat_id):
+                self.blocked_chats.add(chat_id)
+                self.calls[f'{method}:blocked'] += 1
+                return self._error(403, 'Forbidden: bot was blocked by the user')
+            response = self._flood_control(chat_id)
+            if response is not None:
+                self.calls[f'{method}:retry_after'] += 1
+                return response
+            self.calls[f'{method}:ok'] += 1
+            return self._ok(self._message(method, chat_id, data))
+
+        self.calls[method] += 1
+        if method == 'getUpdates':
+            return self._ok(await self._get_updates(int(data.get('offset', 0)), float(data.get('timeout', 0))))
+        if method == 'getMe':
+            return self._ok({'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'})
+        if method == 'getWebhookInfo':
+            return self._ok({'url': '', 'has_custom_certificate': False, 'pending_update_count': len(self.updates)})
+        if method == 'editMessageText':
+            return self._ok({'message_id': int(data.get('message_id', 0)), 'date': int(time.time()),
+                             'chat': {'id': int(data.get('chat_id', 0)), 'type': 'private'}, 'text': data.get('text', '')})
+        if method in ('deleteMessage', 'answerCallbackQuery', 'setWebhook', 'deleteWebhook'):
+            return self._ok(True)
+        return self._error(404, 'Not Found: method not found')
+
+    async def _get_updates(self, offset: int, timeout: float) -> List[Dict[str, Any]]:
+        self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        if not self.updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:100]
+
+    async def post_updates(self, request: web.Request) -> web.Response:
+        updates = await request.json()
+        self.add_updates(updates if isinstance(updates, list) else [updates])
+        return web.json_response({'queued': len(self.updates)})
+
+    def stats(self) -> Dict[str, Any]:
+        return {'calls': dict(sorted(self.calls.items())), 'blocked_chats': len(self.blocked_chats)}
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=MAX_UPLOAD_SIZE)
+        app.router.add_post('/fake/updates', self.post_updates)
+        app.router.add_get('/fake/stats', self.get_stats)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> web.AppRunner:
+        """
+start(host: str = '127.0.0.1', port: int = 0) -> web.AppRunner
+This function starts the server (on a free port by default) and sets base_url to its address.
+"""
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        host, port = runner.addresses[0][:2]
+        self.base_url = f'http://{host}:{port}'
+        return runner
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local fake Telegram Bot API with flood control')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--global-rate', type=float, default=FakeTelegramConfig.global_rate)
+    parser.add_argument('--per-chat-rate', type=float, default=FakeTelegramConfig.per_chat_rate)
+    parser.add_argument('--blocked-share', type=float, default=FakeTelegramConfig.blocked_share,
+                        help='share of the chats that blocked the bot, 0..1')
+    parser.add_argument('--latency', type=float, default=FakeTelegramConfig.latency, help='seconds per call')
+    parser.add_argument('--seed', type=int, default=FakeTelegramConfig.seed)
+    parser.add_argument('--updates', help='JSON or JSON Lines file with updates to serve with getUpdates')
+    arguments = parser.parse_args()
+    fake = FakeTelegram(FakeTelegramConfig(arguments.global_rate, arguments.per_chat_rate, arguments.blocked_share,
+                                           arguments.latency, arguments.seed))
+    if arguments.updates:
+        fake.add_updates(load_updates(arguments.updates))
+    print(f'TELEGRAM_API_URL=http://{arguments.host}:{arguments.port}', flush=True)
+    try:
+        web.run_app(fake.make_app(), host=arguments.host, port=arguments.port, print=None)
+    finally:
+        print(json.dumps(fake.stats(), ensure_ascii=False))
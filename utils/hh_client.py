@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+
+import aiohttp
+
+from utils.metrics import hh_request_seconds, hh_requests
+
+HEADERS = {'Content-Type': 'application/x-www-form-urlencoded',
+           'HH-User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64)'}
+MAX_CONNECTIONS = 20
+MAX_CONCURRENT_REQUESTS = 10
+REQUEST_TIMEOUT = 30
+
+T = TypeVar('T')
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+get_session() -> aiohttp.ClientSession
+This function returns the shared HTTP session used for all HeadHunter API requests.
+The session is created lazily on the first call and keeps a pool of at most
+MAX_CONNECTIONS keep-alive connections, so consecutive requests reuse sockets
+instead of opening a new connection every time.
+Returns:
+aiohttp.ClientSession: The shared session.
+"""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS)
+        timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=HEADERS)
+    return _session
+
+
+async def close_session() -> None:
+    """
+close_session() -> None
+This function closes the shared HTTP session, if it was opened.
+It should be called once when the bot shuts down.
+"""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def fetch_json(url: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+fetch_json(url: str, params: dict = None) -> dict
+This function performs a GET request to the given url with the shared session
+and returns the decoded JSON body. Non-2xx responses raise aiohttp.ClientResponseError.
+Returns:
+dict: The decoded JSON response.
+"""
+    session = get_session()
+    started, status = time.perf_counter(), 'error'
+    try:
+        async with session.get(url, params=params) as response:
+            status = response.status
+            response.raise_for_status()
+            return await response.json()
+    finally:
+        hh_requests.inc(kind='search', status=status)
+        hh_request_seconds.observe(time.perf_counter() - started, kind='search')
+
+
+async def fetch_conditional(url: str, etag: Optional[str] = None,
+                            last_modified: Optional[str] = None) -> Tuple[int, Optional[Dict[str, Any]], Dict[str, str]]:
+    """
+fetch_conditional(url: str, etag: str = None, last_modified: str = None) -> Tuple[int, Optional[dict], dict]
+This function performs a conditional GET request: the etag and last_modified values of a
+previous response are sent as If-None-Match and If-Modified-Since.
+Returns:
+Tuple[int, Optional[dict], dict]: The status code, the decoded JSON body (None for 304 Not Modified)
+and the ETag / Last-Modified headers of the response.
+"""
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    session = get_session()
+    started, status = time.perf_counter(), 'error'
+    try:
+        async with session.get(url, headers=headers) as response:
+            status = response.status
+            validators = {key: response.headers[key] for key in ('ETag', 'Last-Modified') if key in response.headers}
+            if response.status == 304:
+                return response.status, None, validators
+            response.raise_for_status()
+            return response.status, await response.json(), validators
+    finally:
+        hh_requests.inc(kind='detail', status=status)
+        hh_request_seconds.observe(time.perf_counter() - started, kind='detail')
+
+
+async def gather_limited(func: Callable[[Any], Awaitable[T]], arguments: Iterable[Any],
+                         limit: int = MAX_CONCURRENT_REQUESTS,
+                         describe: Callable[[Any], str] = str) -> List[Optional[T]]:
+    """
+gather_limited(func, arguments: Iterable, limit: int = MAX_CONCURRENT_REQUESTS, describe=str) -> List[Optional[T]]
+This function awaits func(argument) for every argument concurrently, with at most `limit`
+calls in flight. The results are returned in the same order as the arguments. A call that
+fails with a network error is logged as describe(argument) (e.g. its url) and its slot in
+the result list is None, so one broken page does not abort the whole batch.
+"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run_one(argument: Any) -> Optional[T]:
+        async with semaphore:
+            try:
+                return await func(argument)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.info(f'Не удалось загрузить {describe(argument)}: {e!r}')
+                return None
+
+    return await asyncio.gather(*(run_one(argument) for argument in arguments))
+
@@ -0,0 +1,342 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, TypeVar
+
+from utils.delivery import GLOBAL_RATE, DeliveryReport
+from utils.utils import vacancy_id
+
+JOB_QUEUE_PATH = os.getenv('JOB_QUEUE_PATH', './instance/jobs.db')
+DELIVERY_SHARDS = int(os.getenv('DELIVERY_SHARDS', 4))
+BATCH_SIZE = 100
+LEASE_SECONDS = 600
+BROADCAST_TIMEOUT = float(os.getenv('BROADCAST_TIMEOUT', 600))
+RESULTS_RETENTION = 7 * 24 * 3600
+
+T = TypeVar('T')
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS delivery_jobs ('
+    'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+    'broadcast TEXT NOT NULL, '
+    'shard INTEGER NOT NULL, '
+    'vacancy TEXT NOT NULL, '
+    'chat_ids TEXT NOT NULL, '
+    "status TEXT NOT NULL DEFAULT 'pending', "
+    'attempts INTEGER NOT NULL DEFAULT 0, '
+    'leased_by TEXT, '
+    'lease_until REAL, '
+    'result TEXT, '
+    'collected INTEGER NOT NULL DEFAULT 0, '
+    'created_at REAL NOT NULL, '
+    'finished_at REAL)',
+    'CREATE INDEX IF NOT EXISTS ix_delivery_jobs_status_shard ON delivery_jobs (status, shard, id)',
+    'CREATE INDEX IF NOT EXISTS ix_delivery_jobs_broadcast ON delivery_jobs (broadcast, status)',
+    'CREATE TABLE IF NOT EXISTS rate_limits ('
+    'name TEXT PRIMARY KEY, '
+    'tokens REAL NOT NULL, '
+    'updated REAL NOT NULL, '
+    'paused_until REAL NOT NULL DEFAULT 0)',
+)
+
+
+def shard_of(chat_id: int, shards: int = DELIVERY_SHARDS) -> int:
+    return chat_id % shards
+
+
+@dataclass
+class LeasedJob:
+    id: int
+    broadcast: str
+    shard: int
+    vacancy: Dict[str, Any]
+    chat_ids: List[int]
+    attempts: int
+    created_at: float
+
+
+class JobQueue:
+    """
+JobQueue(path: str = JOB_QUEUE_PATH, shards: int = DELIVERY_SHARDS)
+Durable queue of delivery jobs in a SQLite database (./instance/jobs.db by default).
+
+A job is one vacancy and a batch of up to BATCH_SIZE chats of the same shard
+(chat_id % shards), so a chat is always handled by the worker that owns its shard and
+the per-chat rate limit can stay in the worker. Workers lease() the pending jobs of their
+shards, send them and complete() them with their result; a job whose worker died is leased
+again when its lease expires, so every message is sent at least once. The bot collect()s the
+results to delete the dead chats. The database also keeps the state of the rate limiters
+shared by all the workers (see SharedTokenBucket).
+
+The methods are blocking (a write may wait up to 10 seconds for the lock held by another
+process); on the event loop, call them with run() or submit(), which use the queue's own thread.
+The bot and the workers must run on the same machine: SQLite in WAL mode does not work on
+a network file system.
+"""
+
+    def __init__(self, path: str = JOB_QUEUE_PATH, shards: int = DELIVERY_SHARDS):
+        self.path = path
+        self.shards = shards
+        self._connection: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._connection = sqlite3.connect(self.path, timeout=10, isolation_level=None,
+                                               check_same_thread=False)
+            self._connection.row_factory = sqlite3.Row
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                self._connection.execute(statement)
+        return self._connection
+
+    def submit(self, func: Callable[..., T], *args: Any) -> 'Future[T]':
+        """
+submit(func, *args) -> concurrent.futures.Future
+This function runs func(*args) (a method of the queue) in the queue's thread and returns its
+future without waiting. There is one thread, so the calls run one at a time, in order.
+"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='jobs')
+        return self._executor.submit(func, *args)
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        """
+run(func, *args) -> T
+This function runs func(*args) in the queue's thread (see submit) and returns its result,
+without blocking the event loop.
+"""
+        return await asyncio.wrap_future(self.submit(func, *args))
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def enqueue(self, broadcast: str, vacancy: Dict[str, Any], chat_ids: Iterable[int],
+                batch_size: int = BATCH_SIZE) -> int:
+        """
+enqueue(broadcast: str, vacancy: dict, chat_ids: Iterable[int], batch_size: int = BATCH_SIZE) -> int
+This function queues the vacancy for the chats, in batches of the same shard, and returns
+the number of jobs created.
+"""
+        by_shard: Dict[int, List[int]] = defaultdict(list)
+        for chat_id in chat_ids:
+            by_shard[shard_of(chat_id, self.shards)].append(chat_id)
+        body, now = json.dumps(vacancy, ensure_ascii=False), time.time()
+        rows = [(broadcast, shard, body, json.dumps(shard_chats[start:start + batch_size]), now)
+                for shard, shard_chats in by_shard.items()
+                for start in range(0, len(shard_chats), batch_size)]
+        with self.connection:
+            self.connection.executemany('INSERT INTO delivery_jobs (broadcast, shard, vacancy, chat_ids, created_at) '
+                                        'VALUES (?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    def lease(self, worker: str, shards: Iterable[int], limit: int = 10,
+              lease_seconds: float = LEASE_SECONDS) -> List[LeasedJob]:
+        """
+lease(worker: str, shards: Iterable[int], limit: int = 10, lease_seconds: float = LEASE_SECONDS)
+    -> List[LeasedJob]
+This function takes up to `limit` pending jobs (or jobs whose lease expired) of the shards
+for `lease_seconds`.
+"""
+        shards = list(shards)
+        now = time.time()
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            rows = connection.execute(
+                f"SELECT * FROM delivery_jobs WHERE shard IN ({', '.join('?' * len(shards))}) AND "
+                "(status = 'pending' OR (status = 'leased' AND lease_until < ?)) ORDER BY id LIMIT ?",
+                (*shards, now, limit)).fetchall()
+            connection.executemany("UPDATE delivery_jobs SET status = 'leased', leased_by = ?, lease_until = ?, "
+                                   'attempts = attempts + 1 WHERE id = ?',
+                                   [(worker, now + lease_seconds, row['id']) for row in rows])
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return [LeasedJob(row['id'], row['broadcast'], row['shard'], json.loads(row['vacancy']),
+                          json.loads(row['chat_ids']), row['attempts'] + 1, row['created_at']) for row in rows]
+
+    def complete(self, job_id: int, result: Dict[str, Any]) -> None:
+        """
+complete(job_id: int, result: dict) -> None
+This function marks the job as done and stores its result
+({'sent': int, 'failed': int, 'retries': int, 'dead': {chat_id: reason}, 'latencies': [...]}).
+"""
+        with self.connection:
+            self.connection.execute("UPDATE delivery_jobs SET status = 'done', result = ?, finished_at = ? WHERE id = ?",
+                                    (json.dumps(result), time.time(), job_id))
+
+    def progress(self, broadcast: str) -> Dict[str, int]:
+        """
+progress(broadcast: str) -> Dict[str, int]
+This function returns the number of jobs of the broadcast per status.
+"""
+        rows = self.connection.execute('SELECT status, COUNT(*) FROM delivery_jobs WHERE broadcast = ? GROUP BY status',
+                                       (broadcast,)).fetchall()
+        return {status: count for status, count in rows}
+
+    def collect(self) -> List[Dict[str, Any]]:
+        """
+collect() -> List[dict]
+This function returns the results of the done jobs that were not collected yet, of any
+broadcast, marks them as collected and deletes the results older than RESULTS_RETENTION.
+"""
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            rows = connection.execute("SELECT id, result FROM delivery_jobs WHERE status = 'done' AND collected = 0"
+                                      ).fetchall()
+            connection.executemany('UPDATE delivery_jobs SET collected = 1 WHERE id = ?', [(row['id'],) for row in rows])
+            connection.execute("DELETE FROM delivery_jobs WHERE status = 'done' AND collected = 1 AND finished_at < ?",
+                               (time.time() - RESULTS_RETENTION,))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return [json.loads(row['result']) for row in rows]
+
+    def take_token(self, name: str, rate: float, capacity: float = 1) -> float:
+        """
+take_token(name: str, rate: float, capacity: float = 1) -> float
+This function takes a token from the shared bucket `name` and returns 0, or returns how many
+seconds to wait before trying again.
+"""
+        now = time.time()
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated, paused_until FROM rate_limits WHERE name = ?',
+                                     (name,)).fetchone()
+            tokens, updated, paused_until = row if row else (capacity, now, 0.0)
+            if paused_until > now:
+                wait = paused_until - now
+            else:
+                tokens = min(capacity, tokens + (now - updated) * rate)
+                wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+                if not wait:
+                    tokens -= 1
+            connection.execute('INSERT INTO rate_limits (name, tokens, updated, paused_until) VALUES (?, ?, ?, ?) '
+                               'ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                               (name, tokens, now, paused_until))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return wait
+
+    def pause(self, name: str, seconds: float) -> None:
+        """
+pause(name: str, seconds: float) -> None
+This function pauses the shared bucket `name` for every worker.
+"""
+        until = time.time() + seconds
+        with self.connection:
+            self.connection.execute('INSERT INTO rate_limits (name, tokens, updated, paused_until) VALUES (?, 0, ?, ?) '
+                                    'ON CONFLICT(name) DO UPDATE SET paused_until = MAX(paused_until, excluded.paused_until)',
+                                    (name, time.time(), until))
+
+
+class SharedTokenBucket:
+    """
+SharedTokenBucket(queue: JobQueue, name: str = 'telegram', rate: float = GLOBAL_RATE, capacity: float = 1)
+Token bucket kept in the job queue database, so all the worker processes together keep to
+the global Telegram rate limit, and a flood control pause of one worker pauses all of them.
+It has the interface of utils.delivery.TokenBucket.
+"""
+
+    def __init__(self, queue: JobQueue, name: str = 'telegram', rate: float = GLOBAL_RATE, capacity: float = 1):
+        self.queue = queue
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+
+    async def acquire(self) -> None:
+        while True:
+            wait = await self.queue.run(self.queue.take_token, self.name, self.rate, self.capacity)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        self.queue.submit(self.queue.pause, self.name, seconds)
+
+
+class QueuedDelivery:
+    """
+QueuedDelivery(queue: JobQueue, timeout: float = BROADCAST_TIMEOUT)
+Broadcast through the job queue, for DELIVERY_MODE=queue. It has the interface of
+utils.delivery.DeliveryScheduler (start(), submit(), join()), but instead of sending the
+messages it queues them for the broadcast workers (see utils.broadcast_worker).
+
+The chats of a vacancy are queued (in the queue's thread) as soon as the next vacancy is submitted. join() waits up
+to `timeout` seconds for the workers to finish the broadcast and returns a DeliveryReport
+built from the results of all the jobs finished since the previous join(), so the dead chats
+of a broadcast that took longer are reported by the next one. on_sent is never called: the
+messages are sent by the workers.
+"""
+
+    def __init__(self, queue: JobQueue, timeout: float = BROADCAST_TIMEOUT):
+        self.queue = queue
+        self.timeout = timeout
+        self.broadcast = ''
+        self.jobs = 0
+        self._vacancy: Optional[Dict[str, Any]] = None
+        self._chat_ids: List[int] = []
+        self._enqueued: List[Future] = []
+        self.on_sent: Optional[Callable[[int, Any], None]] = None
+        self._started_at = time.monotonic()
+
+    def start(self) -> None:
+        self.broadcast = uuid.uuid4().hex
+        self.jobs = 0
+        self._started_at = time.monotonic()
+
+    def submit(self, chat_id: int, vacancy: Dict[str, Any]) -> None:
+        if self._vacancy is not None and vacancy_id(vacancy) != vacancy_id(self._vacancy):
+            self.flush()
+        self._vacancy = vacancy
+        self._chat_ids.append(chat_id)
+
+    def flush(self) -> None:
+        if self._vacancy is not None and self._chat_ids:
+            self._enqueued.append(self.queue.submit(self.queue.enqueue, self.broadcast, self._vacancy, self._chat_ids))
+        self._vacancy, self._chat_ids = None, []
+
+    async def join(self) -> DeliveryReport:
+        self.flush()
+        enqueued, self._enqueued = self._enqueued, []
+        for future in enqueued:
+            self.jobs += await asyncio.wrap_future(future)
+        deadline = time.monotonic() + self.timeout
+        progress = await self.queue.run(self.queue.progress, self.broadcast)
+        while set(progress) - {'done'} and time.monotonic() < deadline:
+            await asyncio.sleep(1)
+            progress = await self.queue.run(self.queue.progress, self.broadcast)
+        if set(progress) - {'done'}:
+            logging.info(f'Рассылка {self.broadcast} не завершена за {self.timeout:.0f} с: {progress}')
+
+        report = DeliveryReport(started_at=self._started_at)
+        for result in await self.queue.run(self.queue.collect):
+            report.sent += result['sent']
+            report.failed += result['failed']
+            report.retries += result['retries']
+            report.dead.update({int(chat_id): reason for chat_id, reason in result['dead'].items()})
+            report.latencies.extend(result['latencies'])
+        report.finished_at = time.monotonic()
+        return report
@@ -0,0 +1,145 @@
+import json
+import logging
+import os
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+from typing import Any, Deque, Dict, List, Optional
+
+LOG_FILE = './logs.txt'
+LOG_FORMAT = '%(asctime)s - %(message)s'
+RECORD_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))
+LOG_ROTATE_SECONDS = float(os.getenv('LOG_ROTATE_SECONDS', 24 * 3600))
+RING_BUFFER_SIZE = 1000
+
+
+class SizeAndTimeRotatingFileHandler(RotatingFileHandler):
+    """
+SizeAndTimeRotatingFileHandler(filename: str, max_bytes: int, backup_count: int, interval: float)
+RotatingFileHandler that also rolls the file over every `interval` seconds (0 to rotate by size
+only). The old files are kept as logs.txt.1 ... logs.txt.<backup_count>.
+"""
+
+    def __init__(self, filename: str, max_bytes: int = LOG_MAX_BYTES, backup_count: int = LOG_BACKUP_COUNT,
+                 interval: float = LOG_ROTATE_SECONDS):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.interval = interval
+        self.rollover_at = self._next_rollover()
+
+    def _next_rollover(self) -> float:
+        return time.time() + self.interval if self.interval else float('inf')
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if time.time() >= self.rollover_at:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self.rollover_at = self._next_rollover()
+
+
+class RingBufferHandler(logging.Handler):
+    """
+RingBufferHandler(capacity: int = RING_BUFFER_SIZE)
+Keeps the last `capacity` log records in memory as dictionaries
+({'time', 'level', 'logger', 'message'} and the exception text, if any),
+so the admin commands can read the recent logs without touching the disk.
+"""
+
+    def __init__(self, capacity: int = RING_BUFFER_SIZE):
+        super().__init__()
+        self.records: Deque[Dict[str, Any]] = deque(maxlen=capacity)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            entry = {'time': record.created, 'level': record.levelname, 'logger': record.name,
+                     'message': record.getMessage()}
+            if record.exc_info:
+                entry['exception'] = logging.Formatter().formatException(record.exc_info)
+            self.records.append(entry)
+        except Exception:
+            self.handleError(record)
+
+    def recent(self, limit: int = 20, level: int = logging.NOTSET) -> List[Dict[str, Any]]:
+        """
+recent(limit: int = 20, level: int = logging.NOTSET) -> List[dict]
+This function returns the last `limit` records of at least `level`, oldest first.
+"""
+        records = [record for record in self.records if logging.getLevelName(record['level']) >= level]
+        return records[-limit:]
+
+    def as_json(self, limit: int = 20, level: int = logging.NOTSET) -> str:
+        """
+as_json(limit: int = 20, level: int = logging.NOTSET) -> str
+This function returns the records of recent() as JSON Lines, for '/logs json'.
+"""
+        return '\n'.join(json.dumps(record, ensure_ascii=False) for record in self.recent(limit, level))
+
+
+ring_buffer = RingBufferHandler()
+
+
+def setup_logging(path: str = LOG_FILE, level: int = logging.INFO) -> None:
+    """
+setup_logging(path: str = LOG_FILE, level: int = logging.INFO) -> None
+This function sends the logs to the rotating file `path` (see SizeAndTimeRotatingFileHandler)
+and to the in-memory ring buffer.
+"""
+    file_handler = SizeAndTimeRotatingFileHandler(path)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(file_handler)
+    root.addHandler(ring_buffer)
+
+
+def tail(path: str, lines: int = 20, block_size: int = 8192) -> List[str]:
+    """
+tail(path: str, lines: int = 20, block_size: int = 8192) -> List[str]
+This function returns the last `lines` lines of the file. It reads the file backwards from
+the end, block by block, so the time does not depend on the size of the file.
+"""
+    if lines <= 0 or not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b''
+        while position > 0 and data.count(b'\n') <= lines:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    return [line.decode('utf-8', errors='replace') for line in data.splitlines()[-lines:]]
+
+
+def format_records(records: List[Dict[str, Any]]) -> str:
+    """
+format_records(records: List[dict]) -> str
+This function formats the ring buffer records as 'time - LEVEL - message' lines, each followed
+by the traceback of its exception, if any.
+"""
+    formatter = logging.Formatter(RECORD_FORMAT)
+    lines = []
+    for record in records:
+        log_record = logging.makeLogRecord({'msg': record['message'], 'levelname': record['level'],
+                                            'created': record['time'], 'msecs': (record['time'] % 1) * 1000})
+        lines.append(formatter.format(log_record))
+        if record.get('exception'):
+            lines.append(record['exception'])
+    return '\n'.join(lines)
+
+
+def recent_logs(limit: int = 20, path: Optional[str] = LOG_FILE) -> str:
+    """
+recent_logs(limit: int = 20, path: str = LOG_FILE) -> str
+This function returns the last `limit` log records from the ring buffer, or, right after
+a restart when the buffer is empty, the last `limit` lines of the log file.
+"""
+    records = ring_buffer.recent(limit)
+    if records or path is None:
+        return format_records(records)
+    return '\n'.join(tail(path, limit))
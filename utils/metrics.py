@@ -0,0 +1,248 @@
+import bisect
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiohttp import web
+
+METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class Metric(ABC):
+    kind = ''
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        ...
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        lines += [f'{name}{_format_labels(labels)} {value:g}' for name, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """
+Counter(name: str, documentation: str)
+Monotonic counter with labels: requests.inc(kind='search', status=200).
+"""
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: object) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        return [(self.name, labels, value) for labels, value in sorted(self.values.items())]
+
+
+class Gauge(Metric):
+    """
+Gauge(name: str, documentation: str)
+Value that goes up and down: set() it, or register a function that is read on every scrape
+with track(func, **labels), e.g. the length of a queue.
+"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self.values: Dict[Labels, float] = {}
+        self.functions: Dict[Labels, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels: object) -> None:
+        self.values[_labels(labels)] = value
+
+    def track(self, function: Callable[[], float], **labels: object) -> None:
+        self.functions[_labels(labels)] = function
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        values = dict(self.values)
+        for labels, function in list(self.functions.items()):
+            values[labels] = function()
+        return [(self.name, labels, value) for labels, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    """
+Histogram(name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS)
+Distribution of durations in seconds with labels. observe(seconds, **labels) records one,
+time(**labels) is a context manager that measures the block.
+"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+        self.series: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, **labels: object) -> None:
+        key = _labels(labels)
+        with self._lock:
+            series = self.series.setdefault(key, [0] * (len(self.buckets) + 2))
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels: object) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: object) -> int:
+        series = self.series.get(_labels(labels))
+        return sum(series[:-1]) if series else 0
+
+    def total(self, **labels: object) -> float:
+        series = self.series.get(_labels(labels))
+        return series[-1] if series else 0.0
+
+    def mean(self, **labels: object) -> float:
+        series = self.series.get(_labels(labels))
+        return series[-1] / sum(series[:-1]) if series and sum(series[:-1]) else 0.0
+
+    def samples(self) -> List[Tuple[str, Labels, float]]:
+        samples = []
+        for labels, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', labels + (('le', f'{bound:g}' if bound != float('inf') else '+Inf'),),
+                                cumulative))
+            samples.append((f'{self.name}_count', labels, cumulative))
+            samples.append((f'{self.name}_sum', labels, series[-1]))
+        return samples
+
+
+class Registry:
+    """
+Registry()
+The metrics of the process. counter(), gauge() and histogram() return the metric with that
+name, creating it on first use, so every module can declare the metrics it records.
+"""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def _get(self, cls, name: str, documentation: str, **kwargs) -> Metric:
+        if name not in self.metrics:
+            self.metrics[name] = cls(name, documentation, **kwargs)
+        return self.metrics[name]
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._get(Counter, name, documentation)
+
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._get(Gauge, name, documentation)
+
+    def histogram(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, documentation, buckets=buckets)
+
+    def render(self) -> str:
+        """
+render() -> str
+This function returns all the metrics in the Prometheus text exposition format.
+"""
+        return '\n'.join(metric.render() for metric in self.metrics.values()) + '\n'
+
+    def summary(self) -> str:
+        """
+summary() -> str
+This function returns a short human-readable digest of the metrics for the /stats command:
+counters and gauges as they are, histograms as count and mean duration.
+"""
+        lines = []
+        for metric in self.metrics.values():
+            if isinstance(metric, Histogram):
+                for labels in sorted(metric.series):
+                    label_dict = dict(labels)
+                    lines.append(f'{metric.name}{_format_labels(labels)}: {metric.count(**label_dict)} шт., '
+                                 f'среднее {metric.mean(**label_dict) * 1000:.0f} мс')
+            else:
+                lines += [f'{name}{_format_labels(labels)}: {value:g}' for name, labels, value in metric.samples()]
+        return '\n'.join(lines)
+
+
+registry = Registry()
+
+hh_requests = registry.counter('hh_requests_total', 'HeadHunter API requests by kind and HTTP status')
+hh_request_seconds = registry.histogram('hh_request_seconds', 'HeadHunter API request latency')
+vacancies = registry.counter('crawl_vacancies_total', 'Vacancies per position and pipeline outcome')
+pipeline_queue_depth = registry.gauge('pipeline_queue_depth', 'Items waiting in front of a pipeline stage')
+stage_seconds = registry.histogram('pipeline_stage_seconds', 'Time a pipeline stage spends on one item')
+render_seconds = registry.histogram('render_seconds', 'Vacancy card render time')
+send_seconds = registry.histogram('telegram_send_seconds', 'Telegram send call latency')
+send_errors = registry.counter('telegram_send_errors_total', 'Failed Telegram sends by error class')
+delivery_queue_depth = registry.gauge('delivery_queue_depth', 'Messages waiting in the delivery scheduler')
+handler_seconds = registry.histogram('handler_seconds', 'Bot message handler latency by handler')
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """
+HandlerTimingMiddleware()
+aiogram middleware that records how long every message update takes to handle in the
+handler_seconds metric, labelled with the name of the handler function that answered it
+(e.g. cmd_start, set_city) or 'unhandled'.
+"""
+
+    async def on_pre_process_message(self, message: types.Message, data: dict) -> None:
+        data['_started'] = time.perf_counter()
+
+    async def on_process_message(self, message: types.Message, data: dict) -> None:
+        data['_handler'] = current_handler.get().__name__
+
+    async def on_post_process_message(self, message: types.Message, results: list, data: dict) -> None:
+        if '_started' in data:
+            handler_seconds.observe(time.perf_counter() - data['_started'], handler=data.get('_handler', 'unhandled'))
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8',
+                        headers={'X-Content-Type-Options': 'nosniff'})
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[web.AppRunner]:
+    """
+start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> Optional[web.AppRunner]
+This function serves GET /metrics in the Prometheus format on host:port, if METRICS_PORT is set.
+The returned runner should be cleaned up on shutdown.
+"""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
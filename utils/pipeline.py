@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+from models.repository import UPSERT_CHUNK_SIZE, upsert_vacancies
+from utils.delivery import DeliveryScheduler
+from utils.detail_cache import detail_cache
+from utils.metrics import pipeline_queue_depth, stage_seconds, vacancies
+from utils.query_planner import SearchQuery, plan_queries
+from utils.routing import RoutingIndex
+from utils.seen_index import seen_index
+from utils.utils import get_position_urls, is_wanted, iter_new_items, parse_vacancy, vacancy_id
+from utils.vacancy_cards import VacancyCardCache
+
+_DONE = object()
+
+Handler = Callable[[Any], AsyncIterator[Any]]
+
+
+@dataclass
+class PipelineConfig:
+    """
+Number of concurrent workers of every stage and the size of the queues between the stages.
+from_env() reads PIPELINE_<STAGE>_CONCURRENCY and PIPELINE_QUEUE_SIZE.
+"""
+    fetch: int = 5
+    normalize: int = 10
+    dedupe: int = 1
+    render: int = 2
+    deliver: int = 1
+    persist: int = 1
+    queue_size: int = 100
+
+    @classmethod
+    def from_env(cls) -> 'PipelineConfig':
+        defaults = cls()
+        values = {name: int(os.getenv(f'PIPELINE_{name.upper()}_CONCURRENCY', getattr(defaults, name)))
+                  for name in ('fetch', 'normalize', 'dedupe', 'render', 'deliver', 'persist')}
+        return cls(**values, queue_size=int(os.getenv('PIPELINE_QUEUE_SIZE', defaults.queue_size)))
+
+
+@dataclass
+class PositionStats:
+    queries: int = 0
+    found: int = 0
+    overlaps: int = 0
+    parsed: int = 0
+    new: int = 0
+    duplicates: int = 0
+    failed: bool = False
+    started_at: float = field(default_factory=time.monotonic)
+    first_delivery_after: Optional[float] = None
+
+    def summary(self) -> str:
+        first_delivery = f'{self.first_delivery_after:.2f} с' if self.first_delivery_after is not None else '-'
+        return (f'запросов {self.queries}, найдено {self.found}, пересечений {self.overlaps}, подходит {self.parsed}, новых {self.new}, повторов {self.duplicates}, '
+                f'первая отправка через {first_delivery}' + (', с ошибками' if self.failed else ''))
+
+
+class CrawlPipeline:
+    """
+CrawlPipeline(routing: RoutingIndex, scheduler: DeliveryScheduler, cards: Optional[VacancyCardCache],
+              config: PipelineConfig = None)
+One crawl-and-deliver cycle, split into stages connected by bounded asyncio queues:
+
+    fetch -> normalize -> dedupe -> render -> deliver -> persist
+
+fetch pages through the search results of every query planned for the cycle (see
+utils.query_planner), drops the results already found by another query and passes on
+the others as soon as their page arrives; normalize gets the detail page (through the detail cache) and builds the
+vacancy; dedupe marks the vacancies that were already sent, which skip render and deliver;
+render draws the card (unless cards is None, when the broadcast workers draw it);
+deliver queues the card for the subscribers in the delivery scheduler;
+persist upserts the vacancies in batches and marks them as seen. All the positions go through the stages at the same time, so a slow
+position does not hold back the others, and a full queue makes the stage in front of it wait.
+The time every stage spends on an item, without the waits for a full queue, is recorded in
+the pipeline_stage_seconds metric.
+
+After the last stage is done, the watermarks of every query whose search did not fail
+are moved forward, unless a vacancy of its position could not be loaded, built or saved
+(the position is then marked failed), so the missed vacancies are fetched again next cycle.
+The first message sent for every position is timed through the scheduler's on_sent callback.
+"""
+
+    def __init__(self, routing: RoutingIndex, scheduler: DeliveryScheduler, cards: Optional[VacancyCardCache],
+                 config: Optional[PipelineConfig] = None):
+        self.routing = routing
+        self.scheduler = scheduler
+        self.cards = cards
+        self.config = config or PipelineConfig.from_env()
+        self.stats: Dict[str, PositionStats] = {}
+        self._queued: Set[Tuple[str, str]] = set()
+        self._unsaved: List[Tuple[str, Dict[str, Any]]] = []
+        self._fetched: Set[Tuple[str, str]] = set()
+        self._watermarks: Dict[SearchQuery, Dict[str, str]] = {}
+        self._failed_queries: Set[SearchQuery] = set()
+        self._positions: Dict[str, str] = {}
+        scheduler.on_sent = self._on_sent
+
+    async def run(self, positions: List[str]) -> Dict[str, PositionStats]:
+        """
+run(positions: List[str]) -> Dict[str, PositionStats]
+This function runs the cycle for the positions and returns the per-position counters.
+"""
+        urls = get_position_urls()
+        queries = plan_queries({position: urls[position] for position in positions if position in urls}, self.routing)
+        self.stats = {position: PositionStats() for position in positions}
+        self._queued = set()
+        self._unsaved = []
+        self._fetched = set()
+        self._watermarks = {}
+        self._failed_queries = set()
+        self._positions = {}
+        stages: List[Tuple[str, Handler, int]] = [
+            ('fetch', self.fetch, self.config.fetch),
+            ('normalize', self.normalize, self.config.normalize),
+            ('dedupe', self.dedupe, self.config.dedupe),
+            ('render', self.render, self.config.render),
+            ('deliver', self.deliver, self.config.deliver),
+            ('persist', self.persist, self.config.persist),
+        ]
+        queues = [asyncio.Queue(maxsize=self.config.queue_size) for _ in range(len(stages) + 1)]
+        for (name, _, _), queue in zip(stages, queues):
+            pipeline_queue_depth.track(queue.qsize, stage=name)
+        tasks = [asyncio.ensure_future(self._run_stage(name, handler, workers, queues[index], queues[index + 1],
+                                                       stages[index + 1][2] if index + 1 < len(stages) else 1))
+                 for index, (name, handler, workers) in enumerate(stages)]
+        tasks.append(asyncio.ensure_future(self._drain(queues[-1])))
+
+        for query in queries:
+            self.stats[query.position].queries += 1
+            await queues[0].put(query)
+        for _ in range(self.config.fetch):
+            await queues[0].put(_DONE)
+        await asyncio.gather(*tasks)
+        await self._save()
+
+        for query, watermark in self._watermarks.items():
+            if query not in self._failed_queries and not self.stats[query.position].failed:
+                await query.set_watermark(watermark)
+        await detail_cache.evict()
+        for position, stats in self.stats.items():
+            for outcome in ('found', 'overlaps', 'parsed', 'new', 'duplicates'):
+                vacancies.inc(getattr(stats, outcome), position=position, outcome=outcome)
+        return self.stats
+
+    async def _run_stage(self, name: str, handler: Handler, workers: int, inbox: asyncio.Queue,
+                         outbox: asyncio.Queue, downstream_workers: int) -> None:
+        async def worker():
+            while True:
+                job = await inbox.get()
+                if job is _DONE:
+                    return
+                started = time.perf_counter()
+                try:
+                    async for result in handler(job):
+                        blocked = time.perf_counter()
+                        await outbox.put(result)
+                        started += time.perf_counter() - blocked
+                except Exception as e:
+                    logging.exception(f'Ошибка на этапе {name}: {e!r}')
+                    if name == 'fetch':
+                        self._failed_queries.add(job)
+                    else:
+                        self.stats[job[0]].failed = True
+                stage_seconds.observe(time.perf_counter() - started, stage=name)
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        for _ in range(downstream_workers):
+            await outbox.put(_DONE)
+
+    @staticmethod
+    async def _drain(queue: asyncio.Queue) -> None:
+        while await queue.get() is not _DONE:
+            pass
+
+    async def fetch(self, query: SearchQuery) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        stats = self.stats[query.position]
+        async for item in iter_new_items(query.url, await query.get_watermark()):
+            if query not in self._watermarks:
+                self._watermarks[query] = {'published_at': item['published_at'], 'id': str(item['id'])}
+            stats.found += 1
+            key = (query.position, str(item['id']))
+            if key in self._fetched:
+                stats.overlaps += 1
+                continue
+            self._fetched.add(key)
+            yield query.position, item
+
+    async def normalize(self, job: Tuple[str, Dict[str, Any]]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        position, item = job
+        full_vacancy, = await detail_cache.get_details([item])
+        if full_vacancy is None:
+            self.stats[position].failed = True
+            return
+        if is_wanted(full_vacancy):
+            self.stats[position].parsed += 1
+            yield position, parse_vacancy(item, full_vacancy)
+
+    async def dedupe(self, job: Tuple[str, Dict[str, Any]]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        position, vacancy = job
+        key = (position, vacancy_id(vacancy))
+        fresh = await seen_index.is_new(position, vacancy) and key not in self._queued
+        if fresh:
+            self._queued.add(key)
+            self.stats[position].new += 1
+            logging.info(f"Нашел вакансию:\n{vacancy['name']}")
+        else:
+            self.stats[position].duplicates += 1
+        yield position, vacancy, fresh
+
+    async def render(self, job: Tuple[str, Dict[str, Any], bool]) -> AsyncIterator[Tuple[str, Dict[str, Any], bool]]:
+        position, vacancy, fresh = job
+        if fresh and self.cards is not None:
+            await self.cards.prerender([vacancy])
+        yield job
+
+    async def deliver(self, job: Tuple[str, Dict[str, Any], bool]) -> AsyncIterator[Tuple[str, Dict[str, Any], bool]]:
+        position, vacancy, fresh = job
+        if fresh:
+            self._positions[vacancy_id(vacancy)] = position
+        for chat_id in self.routing.recipients(position, vacancy['location']) if fresh else ():
+            self.scheduler.submit(chat_id, vacancy)
+        yield job
+
+    def _on_sent(self, chat_id: int, vacancy: Dict[str, Any]) -> None:
+        stats = self.stats.get(self._positions.get(vacancy_id(vacancy), ''))
+        if stats is not None and stats.first_delivery_after is None:
+            stats.first_delivery_after = time.monotonic() - stats.started_at
+
+    async def persist(self, job: Tuple[str, Dict[str, Any], bool]) -> AsyncIterator[None]:
+        position, vacancy, _ = job
+        self._unsaved.append((position, vacancy))
+        if len(self._unsaved) >= UPSERT_CHUNK_SIZE:
+            await self._save()
+        return
+        yield
+
+    async def _save(self) -> None:
+        unsaved, self._unsaved = self._unsaved, []
+        by_position: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for position, vacancy in unsaved:
+            by_position.setdefault(position, {})[vacancy_id(vacancy)] = vacancy
+        for position, vacancies in by_position.items():
+            vacancies = list(vacancies.values())
+            try:
+                await upsert_vacancies(position, vacancies)
+                await seen_index.mark_seen(position, vacancies)
+            except Exception as e:
+                logging.exception(f'Не удалось сохранить вакансии {position}: {e!r}')
+                self.stats[position].failed = True
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+POLL_INTERVAL = float(os.getenv('POLL_INTERVAL', 3600))
+POLL_MIN_INTERVAL = float(os.getenv('POLL_MIN_INTERVAL', 600))
+POLL_MAX_INTERVAL = float(os.getenv('POLL_MAX_INTERVAL', 3 * 3600))
+POLL_TARGET_NEW = float(os.getenv('POLL_TARGET_NEW', 3))
+POLL_JITTER = float(os.getenv('POLL_JITTER', 0.1))
+SHUTDOWN_TIMEOUT = 60
+
+RunCycle = Callable[[List[str]], Awaitable[Dict[str, int]]]
+
+
+@dataclass
+class PollState:
+    interval: float
+    next_run: float
+    last_run: Optional[float] = None
+    rate: Optional[float] = None
+    runs: int = 0
+    new: int = 0
+    last_new: int = 0
+    late: int = 0
+
+    def summary(self) -> str:
+        rate = f'{self.rate * 3600:.1f}' if self.rate is not None else '-'
+        return (f'интервал {self.interval / 60:.0f} мин, новых в час {rate}, '
+                f'запусков {self.runs}, новых {self.new}, опозданий {self.late}')
+
+
+class PollScheduler:
+    """
+PollScheduler(run_cycle, positions: Iterable[str], interval: float = POLL_INTERVAL, ...)
+Polls the positions from inside the bot process, each at its own interval.
+
+run_cycle(positions) runs one crawl cycle for the given positions and returns the number of
+new vacancies found for each of them. The interval of a position follows the observed rate
+of new vacancies (a moving average): it is set so that about target_new vacancies are found
+per poll, within [min_interval, max_interval], so hot positions are polled more often than
+quiet ones. Every interval gets a random jitter of ±jitter so the polls do not line up.
+
+Cycles never overlap: the positions that become due while a cycle is running are polled
+together in the next one. The next poll is planned from the start of the previous one,
+so the cadence does not drift by the length of the cycle. stop() waits for the running
+cycle to finish.
+"""
+
+    def __init__(self, run_cycle: RunCycle, positions: Iterable[str], interval: float = POLL_INTERVAL,
+                 min_interval: float = POLL_MIN_INTERVAL, max_interval: float = POLL_MAX_INTERVAL,
+                 target_new: float = POLL_TARGET_NEW, jitter: float = POLL_JITTER, smoothing: float = 0.5):
+        self.run_cycle = run_cycle
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_new = target_new
+        self.jitter = jitter
+        self.smoothing = smoothing
+        now = time.monotonic()
+        self.states = {position: PollState(interval, now) for position in positions}
+        self.cycles = 0
+        self.busy_time = 0.0
+        self.last_cycle: Optional[float] = None
+        self.started_at = now
+        self._stopping = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """
+start() -> None
+This function starts polling in a background task. The first cycle polls every position.
+"""
+        self.started_at = time.monotonic()
+        self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self, timeout: float = SHUTDOWN_TIMEOUT) -> None:
+        """
+stop(timeout: float = SHUTDOWN_TIMEOUT) -> None
+This function stops polling. A running cycle is given `timeout` seconds to finish before it is cancelled.
+"""
+        if self._task is None:
+            return
+        self._stopping.set()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            logging.warning('Цикл не завершился вовремя и был отменен')
+        self._task = None
+
+    async def _loop(self) -> None:
+        while not self._stopping.is_set():
+            now = time.monotonic()
+            due = [position for position, state in self.states.items() if state.next_run <= now]
+            if not due:
+                delay = min(state.next_run for state in self.states.values()) - now
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._poll(due)
+
+    async def _poll(self, positions: List[str]) -> None:
+        started = time.monotonic()
+        try:
+            found = await self.run_cycle(positions)
+        except Exception as e:
+            logging.exception(f'Ошибка цикла {positions}: {e!r}')
+            found = None
+        finished = time.monotonic()
+        self.cycles += 1
+        self.last_cycle = finished - started
+        self.busy_time += self.last_cycle
+
+        for position in positions:
+            state = self.states[position]
+            if found is not None:
+                self._adapt(state, found.get(position, 0), started)
+            state.last_run = started
+            state.next_run = started + self._jittered(state.interval)
+            if state.next_run < finished:
+                state.late += 1
+                state.next_run = finished
+        logging.info(f'Цикл {positions} за {self.last_cycle:.1f} с. {self.summary()}')
+
+    def _adapt(self, state: PollState, new: int, started: float) -> None:
+        state.runs += 1
+        state.new += new
+        state.last_new = new
+        if state.last_run is None:
+            return
+        rate = new / max(started - state.last_run, 1.0)
+        state.rate = rate if state.rate is None else self.smoothing * rate + (1 - self.smoothing) * state.rate
+        interval = self.target_new / state.rate if state.rate > 0 else state.interval * 2
+        state.interval = min(max(interval, self.min_interval), self.max_interval)
+
+    def _jittered(self, interval: float) -> float:
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def stats(self) -> Dict[str, float]:
+        """
+stats() -> dict
+This function returns the cycle timing: the number of cycles, the duration of the last one,
+and the share of the uptime spent in cycles.
+"""
+        uptime = time.monotonic() - self.started_at
+        return {'cycles': self.cycles,
+                'last_cycle': round(self.last_cycle, 1) if self.last_cycle is not None else None,
+                'busy': round(self.busy_time / uptime, 3) if uptime else 0.0}
+
+    def summary(self) -> str:
+        return f"{self.stats()}\n" + '\n'.join(f'{position}: {state.summary()}'
+                                                for position, state in self.states.items())
@@ -0,0 +1,112 @@
+import json
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from utils.crawler_state import get_watermarks, set_watermarks
+from utils.routing import RoutingIndex
+from utils.utils import parse_hh_datetime
+
+MAX_AREAS_PER_QUERY = 20
+
+
+@dataclass(frozen=True)
+class SearchQuery:
+    """
+One HH search request of a crawl cycle.
+`areas` are the HH area ids the query is scoped to; an empty tuple means the national query
+of the position (its url from api_urls.json as it is). Watermarks are stored per area, under
+watermark_keys, so they do not depend on how the areas are grouped into queries.
+"""
+    position: str
+    url: str
+    areas: Tuple[str, ...] = ()
+
+    @property
+    def watermark_keys(self) -> Tuple[str, ...]:
+        if not self.areas:
+            return (self.position,)
+        return tuple(f'{self.position}:{area_id}' for area_id in self.areas)
+
+    async def get_watermark(self) -> Optional[Dict[str, str]]:
+        """
+get_watermark() -> Optional[dict]
+This function returns the oldest watermark of the query areas, so the query covers every area
+since its own watermark. An area that was not crawled yet (a city chosen since the last cycle)
+starts from the watermark of the national query of the position: its older vacancies were
+already there for the users without a city, and the new subscribers of the city should not get
+a week of them at once. Returns None only if neither the areas nor the position were crawled yet.
+"""
+        stored = await get_watermarks((self.position, *self.watermark_keys))
+        national = stored[self.position]
+        if not self.areas:
+            return national
+        watermarks = [watermark for watermark in (stored[key] or national for key in self.watermark_keys)
+                      if watermark]
+        if not watermarks:
+            return None
+        return min(watermarks, key=lambda watermark: parse_hh_datetime(watermark['published_at']))
+
+    async def set_watermark(self, watermark: Dict[str, str]) -> None:
+        """
+set_watermark(watermark: dict) -> None
+This function stores the watermark for every area of the query.
+"""
+        await set_watermarks(self.watermark_keys, watermark)
+
+
+@lru_cache(maxsize=None)
+def get_area_ids() -> Dict[str, str]:
+    """
+get_area_ids() -> Dict[str, str]
+This function reads './vacancies_json/cities.json' (the HH areas tree of Russia) and returns
+the HH area id of every region and city by its name. If two areas have the same name,
+the first one is used.
+"""
+    with open('./vacancies_json/cities.json', 'r') as f:
+        regions = json.load(f)
+    area_ids: Dict[str, str] = {}
+    stack = list(reversed(regions))
+    while stack:
+        area = stack.pop()
+        area_ids.setdefault(area['name'], area['id'])
+        stack.extend(reversed(area['areas']))
+    return area_ids
+
+
+def area_url(position_url: str, areas: Tuple[str, ...]) -> str:
+    """
+area_url(position_url: str, areas: Tuple[str, ...]) -> str
+This function returns position_url with its `area` parameter replaced by the given areas
+(HH accepts several `area` parameters in one search).
+"""
+    parts = urlsplit(position_url)
+    query = [(key, value) for key, value in parse_qsl(parts.query) if key != 'area']
+    return parts._replace(query=urlencode([('area', area_id) for area_id in areas] + query)).geturl()
+
+
+def plan_queries(position_urls: Dict[str, str], routing: RoutingIndex,
+                 max_areas: int = MAX_AREAS_PER_QUERY) -> List[SearchQuery]:
+    """
+plan_queries(position_urls: Dict[str, str], routing: RoutingIndex, max_areas: int = MAX_AREAS_PER_QUERY)
+    -> List[SearchQuery]
+This function plans the searches of one cycle.
+
+Every position gets its national query, which feeds the users without a city and the
+vacancies table. On top of it, the cities chosen by the subscribers of the position are
+resolved to HH area ids and searched with area-scoped queries of up to max_areas areas each,
+so the local vacancies that the national results push off their first pages are found too.
+Areas without subscribers are never queried, and cities missing from cities.json are skipped.
+The queries overlap (a city vacancy is in the national results as well); the pipeline drops
+the repeats.
+"""
+    area_ids = get_area_ids()
+    queries = []
+    for position, position_url in position_urls.items():
+        queries.append(SearchQuery(position, position_url))
+        areas = sorted({area_ids[city] for city in routing.cities(position) if city in area_ids}, key=int)
+        for start in range(0, len(areas), max_areas):
+            chunk = tuple(areas[start:start + max_areas])
+            queries.append(SearchQuery(position, area_url(position_url, chunk), chunk))
+    return queries
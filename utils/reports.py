@@ -0,0 +1,114 @@
+import csv
+import io
+import tempfile
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import types
+
+from models.repository import UserProfile, UserStats, iter_users
+
+MESSAGE_LIMIT = 4096
+TOP_CITIES = 5
+USERS_PAGE_CALLBACK = 'users:'
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]
+This function splits the text into messages of at most `limit` characters (Telegram's limit
+is 4096), between lines when possible.
+"""
+    messages: List[str] = []
+    current = ''
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            if current:
+                messages.append(current)
+                current = ''
+            messages.append(line[:limit])
+            line = line[limit:]
+        if len(current) + len(line) > limit:
+            messages.append(current)
+            current = ''
+        current += line
+    if current:
+        messages.append(current)
+    return [message.rstrip('\n') for message in messages if message.strip()]
+
+
+def format_user_stats(stats: UserStats, top_cities: int = TOP_CITIES) -> str:
+    """
+format_user_stats(stats: UserStats, top_cities: int = TOP_CITIES) -> str
+This function formats the user report: the total, the users of every position with its
+`top_cities` most popular cities, and the registrations per day.
+"""
+    positions: Dict[str, List[Tuple[Optional[str], int]]] = defaultdict(list)
+    for position, city, count in stats.by_position_city:
+        positions[position].append((city, count))
+
+    lines = [f'Всего пользователей - {stats.total}', '']
+    for position, cities in sorted(positions.items(), key=lambda item: -sum(count for _, count in item[1])):
+        lines.append(f'{position} - {sum(count for _, count in cities)}')
+        without_city = sum(count for city, count in cities if city is None)
+        with_city = [(city, count) for city, count in cities if city is not None]
+        if without_city:
+            lines.append(f'    без локации - {without_city}')
+        for city, count in with_city[:top_cities]:
+            lines.append(f'    {city} - {count}')
+        if len(with_city) > top_cities:
+            lines.append(f'    другие города ({len(with_city) - top_cities}) - '
+                         f'{sum(count for _, count in with_city[top_cities:])}')
+
+    new_users = sum(count for _, count in stats.new_by_day)
+    lines += ['', f"Новых с {stats.since.strftime('%Y-%m-%d')} - {new_users}"]
+    lines += [f'    {day} - {count}' for day, count in stats.new_by_day]
+    if stats.unknown_created_at:
+        lines.append(f'Дата регистрации неизвестна - {stats.unknown_created_at}')
+    return '\n'.join(lines)
+
+
+def format_users_page(users: List[UserProfile]) -> str:
+    """
+format_users_page(users: List[UserProfile]) -> str
+This function formats one page of the user list, one '@username - position - city' line per user.
+"""
+    if not users:
+        return 'Больше пользователей нет'
+    return '\n'.join(f'@{user.username} - {user.position} - {user.city}' for user in users)
+
+
+def users_page_keyboard(users: List[UserProfile], page_size: int) -> Optional[types.InlineKeyboardMarkup]:
+    """
+users_page_keyboard(users: List[UserProfile], page_size: int) -> Optional[types.InlineKeyboardMarkup]
+This function returns the 'next page' button of a full page of the user list; its callback data
+holds the id of the last user of the page ('users:<id>'). A page that is not full is the last one.
+"""
+    if len(users) < page_size:
+        return None
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton(text='Далее', callback_data=f'{USERS_PAGE_CALLBACK}{users[-1].id}'))
+    return markup
+
+
+async def export_users_csv() -> types.InputFile:
+    """
+export_users_csv() -> types.InputFile
+This function writes all the users to a CSV file (id, user_id, chat_id, username, position, city,
+created_at), batch by batch with iter_users, and returns it as a document to send. The file is
+a temporary file on disk (a real io.BufferedRandom, which TextIOWrapper and aiogram's InputFile
+accept on every Python version, unlike SpooledTemporaryFile before 3.11), and it is uploaded
+from the file object, so the list is never held in memory as a whole.
+"""
+    file = tempfile.TemporaryFile()
+    text = io.TextIOWrapper(file, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    writer.writerow(('id', 'user_id', 'chat_id', 'username', 'position', 'city', 'created_at'))
+    async for users in iter_users():
+        writer.writerows((user.id, user.user_id, user.chat_id, user.username, user.position, user.city,
+                          user.created_at.isoformat(sep=' ', timespec='seconds') if user.created_at else '')
+                         for user in users)
+    text.flush()
+    text.detach()
+    file.seek(0)
+    return types.InputFile(file, filename='users.csv')
@@ -0,0 +1,47 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+ANY_CITY = None
+
+
+class RoutingIndex:
+    """
+RoutingIndex(subscriptions: Iterable[Tuple[int, str, Optional[str]]] = ())
+Index of the subscribers, built once per cycle from (chat_id, position, city) rows.
+
+It maps (position, city) to the chat_ids of the users who chose that city and
+(position, ANY_CITY) to the chat_ids of the users without a location, so finding the
+recipients of a vacancy is two dictionary lookups instead of a scan over every user.
+"""
+
+    def __init__(self, subscriptions: Iterable[Tuple[int, str, Optional[str]]] = ()):
+        self._routes: Dict[Tuple[str, Optional[str]], List[int]] = defaultdict(list)
+        for chat_id, position, city in subscriptions:
+            self.add(chat_id, position, city)
+
+    def add(self, chat_id: int, position: str, city: Optional[str] = ANY_CITY) -> None:
+        """
+add(chat_id: int, position: str, city: Optional[str] = ANY_CITY) -> None
+This function subscribes the chat to the vacancies of the position in the city
+(or in any city when city is None).
+"""
+        self._routes[(position, city)].append(chat_id)
+
+    def recipients(self, position: str, location: str) -> List[int]:
+        """
+recipients(position: str, location: str) -> List[int]
+This function returns the chat_ids that should get a vacancy of the position located
+in `location`: the users without a location and the users who chose that city.
+"""
+        return self._routes.get((position, ANY_CITY), []) + self._routes.get((position, location), [])
+
+    def cities(self, position: str) -> List[str]:
+        """
+cities(position: str) -> List[str]
+This function returns the cities chosen by the subscribers of the position.
+"""
+        return sorted(city for (route_position, city), chat_ids in self._routes.items()
+                      if route_position == position and city is not ANY_CITY and chat_ids)
+
+    def __len__(self) -> int:
+        return sum(len(chat_ids) for chat_ids in self._routes.values())
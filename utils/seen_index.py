@@ -0,0 +1,84 @@
+import time
+from typing import Any, Dict, Iterable, List, Set
+
+from utils.crawler_state import get_connection, run
+from utils.utils import vacancy_id
+
+MAX_HISTORY = 5000
+
+
+class SeenIndex:
+    """
+SeenIndex(max_history: int = MAX_HISTORY)
+Index of the vacancies that were already sent, per position, keyed by the HH vacancy id.
+
+The ids of a position are loaded from the crawler state database into a set on first use,
+so checking a vacancy is a set lookup. The database work runs on the crawler state thread
+(see utils.crawler_state.run); the sets themselves are only used on the event loop. A vacancy counts as new only when its id was never
+seen: an edited salary or a different snippet does not make it new again.
+The newest `max_history` ids per position are kept, which is much more than one search page,
+so a vacancy that drops off the first page and comes back is not sent twice.
+"""
+
+    def __init__(self, max_history: int = MAX_HISTORY):
+        self.max_history = max_history
+        self._ids: Dict[str, Set[str]] = {}
+
+    async def _position_ids(self, position_name: str) -> Set[str]:
+        if position_name not in self._ids:
+            ids = await run(self._load, position_name)
+            self._ids.setdefault(position_name, ids)
+        return self._ids[position_name]
+
+    @staticmethod
+    def _load(position_name: str) -> Set[str]:
+        rows = get_connection().execute('SELECT vacancy_id FROM seen_vacancies WHERE position = ?',
+                                        (position_name,)).fetchall()
+        return {row['vacancy_id'] for row in rows}
+
+    async def is_new(self, position_name: str, vacancy: Dict[str, Any]) -> bool:
+        """
+is_new(position_name: str, vacancy: dict) -> bool
+This function returns True if the vacancy was never seen for the position.
+"""
+        return vacancy_id(vacancy) not in await self._position_ids(position_name)
+
+    async def seed(self, position_name: str, vacancies: Iterable[Dict[str, Any]]) -> None:
+        """
+seed(position_name: str, vacancies: Iterable[dict]) -> None
+This function marks the vacancies as seen if the index of the position is still empty.
+It is used to fill the index from the saved vacancies on the first run, so the vacancies
+that subscribers already got are not sent again.
+"""
+        if not await self._position_ids(position_name):
+            await self.mark_seen(position_name, vacancies)
+
+    async def mark_seen(self, position_name: str, vacancies: Iterable[Dict[str, Any]]) -> None:
+        """
+mark_seen(position_name: str, vacancies: Iterable[dict]) -> None
+This function adds the vacancies to the index of the position and drops the oldest ids
+over max_history.
+"""
+        added = [vacancy_id(vacancy) for vacancy in vacancies]
+        if not added:
+            return
+        dropped = await run(self._save, position_name, added, time.time())
+        ids = await self._position_ids(position_name)
+        ids.update(added)
+        ids.difference_update(dropped)
+
+    def _save(self, position_name: str, added: List[str], now: float) -> List[str]:
+        connection = get_connection()
+        connection.executemany('INSERT INTO seen_vacancies (position, vacancy_id, seen_at) VALUES (?, ?, ?) '
+                               'ON CONFLICT(position, vacancy_id) DO NOTHING',
+                               [(position_name, added_id, now) for added_id in added])
+        dropped = [row['vacancy_id'] for row in connection.execute(
+            'SELECT vacancy_id FROM seen_vacancies WHERE position = ? ORDER BY seen_at DESC LIMIT -1 OFFSET ?',
+            (position_name, self.max_history)).fetchall()]
+        connection.executemany('DELETE FROM seen_vacancies WHERE position = ? AND vacancy_id = ?',
+                               [(position_name, dropped_id) for dropped_id in dropped])
+        connection.commit()
+        return dropped
+
+
+seen_index = SeenIndex()
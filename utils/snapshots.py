@@ -0,0 +1,148 @@
+import asyncio
+import glob
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+from typing import Awaitable, BinaryIO, Callable, List
+
+from sqlalchemy.engine import URL, Engine
+
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', './instance/snapshots')
+SNAPSHOT_INTERVAL = float(os.getenv('SNAPSHOT_INTERVAL', 0))
+SNAPSHOT_KEEP = int(os.getenv('SNAPSHOT_KEEP', 7))
+CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+
+
+def gzip_stream(source: BinaryIO, path: str) -> None:
+    """
+gzip_stream(source: BinaryIO, path: str) -> None
+This function compresses the stream into the gzip file `path`, CHUNK_SIZE bytes at a time.
+"""
+    with gzip.open(path, 'wb', compresslevel=6) as target:
+        shutil.copyfileobj(source, target, CHUNK_SIZE)
+
+
+def backup_sqlite(database: str, path: str) -> None:
+    """
+backup_sqlite(database: str, path: str) -> None
+This function copies the SQLite database with the online backup API in a single step: the copy
+is read in one transaction, so it is consistent, and as the database is in WAL mode the bot keeps
+writing meanwhile. (A backup in several steps starts over whenever another connection writes, and
+may never finish while the bot is busy.) The copy is then compressed into `path`.
+"""
+    descriptor, copy_path = tempfile.mkstemp(suffix='.db', dir=os.path.dirname(path))
+    os.close(descriptor)
+    try:
+        source = sqlite3.connect(database)
+        target = sqlite3.connect(copy_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        with open(copy_path, 'rb') as copy:
+            gzip_stream(copy, path)
+    finally:
+        os.remove(copy_path)
+
+
+def dump_postgres(url: URL, path: str) -> None:
+    """
+dump_postgres(url: URL, path: str) -> None
+This function runs pg_dump for the database url and compresses its output into `path` as it arrives.
+The connection is passed to pg_dump as --host/--port/--username/--dbname, and the password in its
+environment (PGPASSWORD), so it does not show up in the process list.
+"""
+    command = ['pg_dump', '--no-owner', '--no-privileges']
+    if url.host:
+        command += ['--host', url.host]
+    if url.port:
+        command += ['--port', str(url.port)]
+    if url.username:
+        command += ['--username', url.username]
+    command += ['--dbname', url.database or '']
+    env = dict(os.environ)
+    if url.password:
+        env['PGPASSWORD'] = url.password
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, env=env)
+    try:
+        gzip_stream(process.stdout, path)
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode:
+        raise RuntimeError(f'pg_dump завершился с кодом {returncode}')
+
+
+def take_snapshot(engine: Engine, directory: str = SNAPSHOT_DIR) -> str:
+    """
+take_snapshot(engine: Engine, directory: str = SNAPSHOT_DIR) -> str
+This function saves a compressed snapshot of the database of the engine in `directory`:
+database-<time>.db.gz for SQLite (see backup_sqlite) or database-<time>.sql.gz for Postgres
+(see dump_postgres). It is blocking, use take_snapshot_async on the event loop.
+The file appears under its name only when it is complete.
+Returns:
+str: The path of the snapshot.
+"""
+    os.makedirs(directory, exist_ok=True)
+    sqlite = engine.dialect.name == 'sqlite'
+    path = os.path.join(directory, f"database-{time.strftime('%Y%m%d-%H%M%S')}.{'db' if sqlite else 'sql'}.gz")
+    partial_path = f'{path}.part'
+    try:
+        if sqlite:
+            backup_sqlite(engine.url.database, partial_path)
+        else:
+            dump_postgres(engine.url, partial_path)
+        os.replace(partial_path, path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return path
+
+
+async def take_snapshot_async(engine: Engine, directory: str = SNAPSHOT_DIR) -> str:
+    """
+take_snapshot_async(engine: Engine, directory: str = SNAPSHOT_DIR) -> str
+This function runs take_snapshot in a worker thread, so the bot keeps answering meanwhile.
+"""
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    path = await loop.run_in_executor(None, take_snapshot, engine, directory)
+    logging.info(f'Снимок базы {path}: {os.path.getsize(path) / 1024:.0f} КБ за {time.monotonic() - started:.1f} с')
+    return path
+
+
+def prune_snapshots(directory: str = SNAPSHOT_DIR, keep: int = SNAPSHOT_KEEP) -> List[str]:
+    """
+prune_snapshots(directory: str = SNAPSHOT_DIR, keep: int = SNAPSHOT_KEEP) -> List[str]
+This function deletes all but the `keep` newest snapshots and returns the deleted paths.
+"""
+    snapshots = sorted(glob.glob(os.path.join(directory, 'database-*.gz')))
+    deleted = snapshots[:-keep] if keep > 0 else snapshots
+    for path in deleted:
+        os.remove(path)
+    return deleted
+
+
+async def run_periodic_snapshots(engine: Engine, send: Callable[[str], Awaitable[None]],
+                                 interval: float = SNAPSHOT_INTERVAL, keep: int = SNAPSHOT_KEEP) -> None:
+    """
+run_periodic_snapshots(engine: Engine, send, interval: float = SNAPSHOT_INTERVAL, keep: int = SNAPSHOT_KEEP) -> None
+This function takes a snapshot every `interval` seconds, keeps the `keep` newest ones and passes
+every new snapshot to `send(path)`, until it is cancelled. A failed snapshot is logged and
+the next one is taken on schedule.
+"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            path = await take_snapshot_async(engine)
+            prune_snapshots(os.path.dirname(path), keep)
+            await send(path)
+        except Exception as e:
+            logging.exception(f'Не удалось сделать снимок базы: {e!r}')
@@ -1,138 +1,133 @@
 import json
-import os
 import re
-from io import BytesIO
-from typing import Union, BinaryIO, List, Dict, Any
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+from urllib.parse import parse_qsl, urlencode, urlsplit
 
-import requests
 from aiogram import types
 
-from models.models import User
-from setup_db import db
-from utils.change_image import add_text_to_image
+from utils.hh_client import fetch_json
+from utils.logs import recent_logs, ring_buffer
 from utils.validators import validate_description_requirements, validate_salary
 
 
-def get_vacancies(position_name: str) -> List[Dict[str, Any]]:
-    
-    """
+SEARCH_PAGE_SIZE = 100
+MAX_SEARCH_PAGES = 20
+
 
-    This function takes in a single argument, position_name which is a string representing 
-    the name of the position for which you want to fetch the vacancies.
-    
-    It reads urls from the file './vacancies_json/api_urls.json' and filters 
-    the url that corresponds to the position_name passed as an argument.
-    
-    Then it calls vacancies_for_new_users function with the filtered url and 
-    returns the list of vacancies
-    
+def get_position_urls() -> Dict[str, str]:
     """
+get_position_urls() -> Dict[str, str]
+This function reads './vacancies_json/api_urls.json' and returns the search url of every position.
+"""
     with open('./vacancies_json/api_urls.json', 'r') as f:
         urls = json.load(f)
-    for url in urls:
-        if position_name == url['name']:
-            vacancies = vacancies_for_new_users(url['url'])
-    return vacancies
+    return {url['name']: url['url'] for url in urls}
 
 
-def vacancies_for_new_users(position_url: str) -> List[Dict[str, Any]]:
+async def iter_new_items(position_url: str, watermark: Optional[Dict[str, str]] = None) -> AsyncIterator[Dict[str, Any]]:
     """
-
-    This function takes in a single argument, position_url which is a string 
-    representing the url of the position for which you want to fetch the vacancies.
-    
-    It fetches the vacancies data from the API using requests library.
-    
-    It iterates through the API response and filters the vacancies with experience of 3-6 years.
-    
-    Then it extracts the required data of each vacancy like name, salary, schedule, 
-    created_at, published_at, experience, company, location, description, requirements,
-    skills, url
-    
-    It calls validate_description_requirements and validate_salary function to format 
-    the description, requirements and salary respectively.
-    
-    It replaces dashes in location with underscores.
-    
-    Finally, it returns the list of vacancies in form of dictionary
+iter_new_items(position_url: str, watermark: dict = None) -> AsyncIterator[dict]
+This function yields the search results published after the watermark, newest first, as soon as
+each page arrives, so the next stages can work on the first page while the following ones are loading.
+Without a watermark only the first page of position_url is read. With a watermark, search_period
+is replaced with date_from=<watermark published_at> and the pages are read until the watermark vacancy.
+"""
+    if watermark is None:
+        api_vacancies = await fetch_json(position_url)
+        for item in api_vacancies['items']:
+            yield item
+        return
+
+    query = [(key, value) for key, value in parse_qsl(urlsplit(position_url).query)
+             if key not in ('search_period', 'date_from', 'page', 'per_page')]
+    query += [('date_from', watermark['published_at']), ('per_page', SEARCH_PAGE_SIZE)]
+    base_url = urlsplit(position_url)._replace(query='').geturl()
+    watermark_time = parse_hh_datetime(watermark['published_at'])
+
+    for page in range(MAX_SEARCH_PAGES):
+        api_vacancies = await fetch_json(f"{base_url}?{urlencode(query + [('page', page)])}")
+        for item in api_vacancies['items']:
+            if str(item['id']) == watermark['id'] or parse_hh_datetime(item['published_at']) < watermark_time:
+                return
+            yield item
+        if page + 1 >= api_vacancies.get('pages', 0):
+            break
+
+
+def parse_hh_datetime(value: str) -> datetime:
     """
+parse_hh_datetime(value: str) -> datetime
+This function parses a HeadHunter timestamp such as '2023-01-18T09:45:42+0300'.
+"""
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S%z')
 
-    vacancies = []
-    headers = {'Content-Type': 'application/x-www-form-urlencoded',
-               'HH-User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64)'}
-
-    with requests.get(position_url, headers=headers) as api_vacancies:
-        api_vacancies = api_vacancies.json()
-
-        for url in api_vacancies['items']:
-            with requests.get(url['url'], headers=headers) as response:
-                full_vacancy = response.json()
-            if full_vacancy['experience']['id'] != 'between3And6':
-
-                vacancy_name = full_vacancy['name']
-                salary = full_vacancy['salary']
-                schedule = full_vacancy['schedule']['name']
-                created_at = full_vacancy['created_at']
-                published_at = full_vacancy['published_at']
-                experience = full_vacancy['experience']['name']
-                company = full_vacancy['employer']['name']
-                location = full_vacancy['area']['name']
-                description = url['snippet']['responsibility']
-                requirements = url['snippet']['requirement']
-                description, requirements = validate_description_requirements(description, requirements)
-                url = full_vacancy['alternate_url']
-                skills = [skill['name'] for skill in full_vacancy['key_skills']]
-
-                if skills is None:
-                    skills = 'Не указаны'
-                else:
-                    skills = ", ".join(skills)
-
-                if experience == 'Нет опыта':
-                    experience = re.sub(r'Нет опыта', 'Можно без опыта', experience)
-                salary = validate_salary(salary)
-
-                
-
-                vacancies.append({
-                    'name': vacancy_name,
-                    'salary': salary,
-                    'company': company,
-                    'created_at': created_at,
-                    'published_at': published_at,
-                    'schedule': schedule,
-                    'experience': experience,
-                    'location': location,
-                    'description': description,
-                    'requirements': requirements,
-                    'skills': skills,
-                    'url': url
-                })
-            else:
-                continue
 
-    return vacancies
+def is_wanted(full_vacancy: Dict[str, Any]) -> bool:
+    """
+is_wanted(full_vacancy: dict) -> bool
+This function returns False for the vacancies the bot does not send: the ones that
+require 3-6 years of experience.
+"""
+    return full_vacancy['experience']['id'] != 'between3And6'
 
 
-def write_vacancies(vacancies: List[Dict[str, Any]], position_name: str) -> None:
+def vacancy_id(vacancy: Dict[str, Any]) -> str:
     """
-This function writes a list of vacancies to a JSON file.
+vacancy_id(vacancy: dict) -> str
+This function returns the HeadHunter id of a vacancy dictionary.
+The id is taken from the vacancy url ('https://hh.ru/vacancy/75933277'), which is present
+in the saved vacancies as well as in the freshly fetched ones.
+"""
+    return vacancy['url'].rstrip('/').rsplit('/', 1)[-1]
 
-Args:
-vacancies (List[Dict[str, Any]]): A list of dictionaries containing information about the vacancies.
-position_name (str): The name of the position for which the vacancies are being written.
 
+def parse_vacancy(item: Dict[str, Any], full_vacancy: Dict[str, Any]) -> Dict[str, Any]:
+    """
+parse_vacancy(item: dict, full_vacancy: dict) -> dict
+This function builds the vacancy dictionary stored and sent by the bot.
+item is the entry from the search results (its snippet holds the short description
+and requirements), full_vacancy is the vacancy detail page.
+
+It extracts name, salary, schedule, created_at, published_at, experience, company,
+location, description, requirements, skills and url, and formats the description,
+requirements and salary with validate_description_requirements and validate_salary.
 Returns:
-None
-
+dict: The vacancy dictionary.
 """
-    with open(f'./vacancies_json/{position_name}.json', 'w') as f:
-        json.dump(vacancies, f, indent=2, ensure_ascii=False, sort_keys=True)
+    description, requirements = validate_description_requirements(item['snippet']['responsibility'],
+                                                                   item['snippet']['requirement'])
+    skills = [skill['name'] for skill in full_vacancy['key_skills']]
+    if skills is None:
+        skills = 'Не указаны'
+    else:
+        skills = ", ".join(skills)
+
+    experience = full_vacancy['experience']['name']
+    if experience == 'Нет опыта':
+        experience = re.sub(r'Нет опыта', 'Можно без опыта', experience)
+
+    return {
+        'name': full_vacancy['name'],
+        'salary': validate_salary(full_vacancy['salary']),
+        'company': full_vacancy['employer']['name'],
+        'created_at': full_vacancy['created_at'],
+        'published_at': full_vacancy['published_at'],
+        'schedule': full_vacancy['schedule']['name'],
+        'experience': experience,
+        'location': full_vacancy['area']['name'],
+        'description': description,
+        'requirements': requirements,
+        'skills': skills,
+        'url': full_vacancy['alternate_url']
+    }
 
 
 def open_vacancies(position_name: str) -> List[Dict[str, Any]]:
     """
 This function opens a JSON file containing a list of vacancies and returns the data in the form of a list of dictionaries.
+The vacancies are stored in the database now; the JSON files are only imported on the first
+start (see app.import_vacancy_snapshots).
 
 Args:
 position_name (str): The name of the position for which the vacancies are being read.
@@ -168,37 +163,11 @@ str: A string containing the name, experience, salary, location, requirements an
     return first_vacancy
 
 
-def create_user(user_id, chat_id, username, position) -> None:
-    """
-This function creates a new user and adds it to the database.
-
-Args:
-user_id (int): The user's unique identifier.
-chat_id (int): The chat's unique identifier.
-username (str): The user's username.
-position (str): The user's position.
-
-Returns:
-None
-"""
-    user = User(user_id=user_id, chat_id=chat_id, username=username, position=position)
-    db.session.add(user)
-    db.session.commit()
-
-
-def send_one_vacancy(vacancy: dict) -> Union[str, any, BinaryIO]:
+def vacancy_caption(vacancy: dict) -> Tuple[str, types.InlineKeyboardMarkup]:
     """
-This function creates a string, an InlineKeyboardMarkup object, and a photo from 
-the given vacancy's information.
-
-Args:
-vacancy (dict): A dictionary containing information about a single vacancy, including 
-the name, schedule, company, location, salary, experience, description, requirements, skills, and url.
-
-Returns:
-Union[str, any, BinaryIO]: A string containing information about the vacancy, 
-an InlineKeyboardMarkup object with a button to apply to the vacancy, and a photo
-with the vacancy's information.
+vacancy_caption(vacancy: dict) -> Tuple[str, types.InlineKeyboardMarkup]
+This function creates the caption of the vacancy card and the InlineKeyboardMarkup object
+with a button to apply to the vacancy.
 """
     location = re.sub(r'-', '_', vacancy['location'])
     vacancy_text = f"<strong>Позиция:</strong> {vacancy['name']}\n" \
@@ -212,66 +181,19 @@ with the vacancy's information.
                    f"<strong>Ключевые навыки:</strong> {vacancy['skills']}\n"
     markup = types.InlineKeyboardMarkup()
     markup.add(types.InlineKeyboardButton(text='Откликнуться', url=vacancy['url']))
-    photo = add_text_to_image(vacancy_name=vacancy['name'],
-                              company_name=vacancy['company'],
-                              salary=vacancy['salary'])
-    return vacancy_text, markup, photo
-
-
-def delete_created_image(save_name: str) -> None:
-    """
-delete_created_image(save_name: str) -> None:
-This function deletes the image with the specified name from the 'media/saved_images' directory.
-The image should have a '.jpg' extension.
-Args:
-save_name (str): The name of the image file to be deleted.
-Returns:
-None
-"""
-    if os.path.exists(save_name):
-        os.remove(f'./media/saved_images/{save_name}.jpg')
+    return vacancy_text, markup
 
 
-def delete_files_from_folder():
+def send_logs(structured: bool = False) -> str:
     """
-delete_files_from_folder() -> None
-This function deletes all files from the 'media/saved_images' directory.
-Returns:
-None
-"""
-    for file in os.listdir('./media/saved_images'):
-        file_path = os.path.join('./media/saved_images', file)
-        try:
-            if os.path.isfile(file_path):
-                os.unlink(file_path)
-        except Exception as e:
-            print(f'Error deleting {file_path}: {e}')
-
-
-def send_logs() -> str:
-    """
-send_logs() -> str
-This function reads the last 20 lines of the 'logs.txt' file and returns the logs as a string.
-Returns:
-str: The last 20 lines of logs from the 'logs.txt' file.
-    """
-    log = ''
-    with open('./logs.txt', 'r') as f:
-        logs = f.readlines()
-    for string in logs[-20:-1]:
-        log += string
-    return log
-
-
-def get_db_file() -> types.InputFile:
-    """
-    get_db_file() -> types.InputFile
-This function opens the 'instance/database.db' file and reads it as binary. 
-It then returns it as a InputFile object.
-
+send_logs(structured: bool = False) -> str
+This function returns the last 20 log records as a string, with their level and traceback.
+They are read from the in-memory ring buffer, or from the end of the 'logs.txt' file after
+a restart (see utils.logs). With structured=True the records of the ring buffer are returned
+as JSON Lines (time, level, logger, message, exception).
 Returns:
-types.InputFile: The binary content of 'instance/database.db' file wrapped as a InputFile object.
+str: The last 20 log records.
     """
-    with open('./instance/database.db', 'rb') as file:
-        db_file = types.InputFile(BytesIO(file.read()), filename='database.db')
-    return db_file
+    if structured:
+        return ring_buffer.as_json(20)
+    return recent_logs(20)
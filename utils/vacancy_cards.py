@@ -0,0 +1,79 @@
+import asyncio
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Any, Dict, Iterable, Optional
+
+from aiogram import Bot, types
+
+from utils.change_image import render_batch, render_vacancy_image_async
+from utils.utils import vacancy_caption, vacancy_id
+
+
+@dataclass
+class VacancyCard:
+    text: str
+    markup: types.InlineKeyboardMarkup
+    image: bytes
+    file_id: Optional[str] = None
+
+
+class VacancyCardCache:
+    """
+VacancyCardCache()
+Per-cycle cache of the rendered vacancy cards, keyed by the HH vacancy id.
+
+The card of a vacancy is rendered once, in the render pool (see utils.change_image);
+prerender() renders the new vacancies of a position in parallel before they are sent.
+The first successful send_photo uploads the image, and the photo file_id returned by Telegram
+is sent to every other recipient, so the image is neither drawn nor uploaded again. Sends of a card that has no file_id yet are serialized,
+so concurrent workers wait for the first upload instead of uploading the same image.
+"""
+
+    def __init__(self):
+        self._cards: Dict[str, VacancyCard] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.renders = 0
+        self.uploads = 0
+
+    def _add(self, vacancy: Dict[str, Any], image: bytes) -> VacancyCard:
+        text, markup = vacancy_caption(vacancy)
+        card = self._cards[vacancy_id(vacancy)] = VacancyCard(text, markup, image)
+        self.renders += 1
+        return card
+
+    async def prerender(self, vacancies: Iterable[Dict[str, Any]]) -> None:
+        """
+prerender(vacancies: Iterable[dict]) -> None
+This function renders the cards of the vacancies that are not cached yet, in parallel.
+"""
+        missing = [vacancy for vacancy in vacancies if vacancy_id(vacancy) not in self._cards]
+        for vacancy, image in zip(missing, await render_batch(missing)):
+            self._add(vacancy, image)
+
+    async def send(self, bot: Bot, chat_id: int, vacancy: Dict[str, Any]) -> types.Message:
+        """
+send(bot: Bot, chat_id: int, vacancy: dict) -> types.Message
+This function sends the card of the vacancy to the chat, uploading the image only if
+Telegram does not have it yet.
+"""
+        key = vacancy_id(vacancy)
+        card = self._cards.get(key)
+        if card is not None and card.file_id:
+            return await self._send_photo(bot, chat_id, card, card.file_id)
+
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            card = self._cards.get(key)
+            if card is None:
+                image = await render_vacancy_image_async(vacancy['name'], vacancy['company'], vacancy['salary'])
+                card = self._add(vacancy, image)
+            if card.file_id:
+                return await self._send_photo(bot, chat_id, card, card.file_id)
+            message = await self._send_photo(bot, chat_id, card, types.InputFile(BytesIO(card.image), 'image.jpg'))
+            self.uploads += 1
+            card.file_id = message.photo[-1].file_id
+            return message
+
+    @staticmethod
+    async def _send_photo(bot: Bot, chat_id: int, card: VacancyCard, photo: Any) -> types.Message:
+        return await bot.send_photo(chat_id, photo, caption=card.text, reply_markup=card.markup,
+                                    parse_mode=types.ParseMode.HTML)
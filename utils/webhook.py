@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List
+
+from aiogram.bot import api
+from aiohttp import ClientSession, web
+
+DRAIN_TIMEOUT = 30
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '').rstrip('/')
+
+
+@dataclass(frozen=True)
+class WebhookConfig:
+    """
+Settings of the webhook mode, read by from_env() from:
+    BOT_MODE                 'webhook' to serve updates over a webhook, 'polling' (default) to long poll
+    WEBHOOK_URL              public https base url Telegram sends the updates to, e.g. https://bot.example.com;
+                             when empty, the webhook is not registered (local/offline mode)
+    WEBHOOK_PATH             path of the endpoint, '/webhook' by default
+    WEBAPP_HOST, WEBAPP_PORT address the aiohttp server listens on, 0.0.0.0:8080 by default
+    WEBHOOK_MAX_CONNECTIONS  how many updates Telegram may deliver at the same time, 40 by default
+    WEBHOOK_CHECK_IP         '1' to accept updates only from the Telegram networks
+"""
+    enabled: bool = False
+    url: str = ''
+    path: str = '/webhook'
+    host: str = '0.0.0.0'
+    port: int = 8080
+    max_connections: int = 40
+    check_ip: bool = False
+
+    @classmethod
+    def from_env(cls) -> 'WebhookConfig':
+        return cls(enabled=os.getenv('BOT_MODE', 'polling') == 'webhook',
+                   url=os.getenv('WEBHOOK_URL', '').rstrip('/'),
+                   path=os.getenv('WEBHOOK_PATH', cls.path),
+                   host=os.getenv('WEBAPP_HOST', cls.host),
+                   port=int(os.getenv('WEBAPP_PORT', cls.port)),
+                   max_connections=int(os.getenv('WEBHOOK_MAX_CONNECTIONS', cls.max_connections)),
+                   check_ip=os.getenv('WEBHOOK_CHECK_IP', '0') == '1')
+
+    @property
+    def webhook_url(self) -> str:
+        return f'{self.url}{self.path}' if self.url else ''
+
+
+def use_api_server(base_url: str = TELEGRAM_API_URL) -> None:
+    """
+use_api_server(base_url: str = TELEGRAM_API_URL) -> None
+This function sends the Bot API requests of every Bot of the process to base_url
+(e.g. http://127.0.0.1:8081, the fake server of utils.fake_telegram) instead of https://api.telegram.org.
+An empty base_url keeps Telegram.
+"""
+    if base_url:
+        api.API_URL = f'{base_url}/bot{{token}}/{{method}}'
+        api.FILE_URL = f'{base_url}/file/bot{{token}}/{{path}}'
+
+
+class UpdateTracker:
+    """
+UpdateTracker()
+aiohttp middleware that counts the webhook requests being processed.
+
+Every update is handled in its own request, so updates are processed concurrently
+(up to WEBHOOK_MAX_CONNECTIONS at a time). aiohttp runs the on_shutdown hooks before it waits
+for the running requests, so the bot calls drain() first on shutdown and only then closes
+the HTTP session and the pools the handlers use.
+"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.handled = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        self.in_flight += 1
+        self._idle.clear()
+        try:
+            return await handler(request)
+        finally:
+            self.in_flight -= 1
+            self.handled += 1
+            if not self.in_flight:
+                self._idle.set()
+
+    async def drain(self, timeout: float = DRAIN_TIMEOUT) -> bool:
+        """
+drain(timeout: float = DRAIN_TIMEOUT) -> bool
+This function waits until the updates being processed are done. Returns False on timeout.
+"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logging.warning(f'Не дождался обработки {self.in_flight} обновлений')
+            return False
+
+
+def load_updates(path: str) -> List[Dict[str, Any]]:
+    """
+load_updates(path: str) -> List[dict]
+This function reads recorded Telegram updates: a JSON list, a single update,
+or one update per line (JSON Lines).
+"""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read().strip()
+    if text.startswith('['):
+        return json.loads(text)
+    if text.startswith('{') and '\n' not in text:
+        return [json.loads(text)]
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+async def replay_updates(url: str, updates: Iterable[Dict[str, Any]], concurrency: int = 10) -> List[int]:
+    """
+replay_updates(url: str, updates: Iterable[dict], concurrency: int = 10) -> List[int]
+This function POSTs the recorded updates to the local webhook endpoint, `concurrency` at a time,
+the way Telegram delivers them, and returns the HTTP status of every request.
+"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def post(session: ClientSession, update: Dict[str, Any]) -> int:
+        async with semaphore:
+            async with session.post(url, json=update) as response:
+                await response.read()
+                return response.status
+
+    async with ClientSession() as session:
+        return await asyncio.gather(*(post(session, update) for update in updates))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='POST recorded Telegram updates to a local webhook')
+    parser.add_argument('updates', help='JSON or JSON Lines file with the updates')
+    parser.add_argument('--url', default=f"http://127.0.0.1:{WebhookConfig.from_env().port}{WebhookConfig.from_env().path}")
+    parser.add_argument('--concurrency', type=int, default=10)
+    arguments = parser.parse_args()
+    started = time.monotonic()
+    statuses = asyncio.run(replay_updates(arguments.url, load_updates(arguments.updates), arguments.concurrency))
+    print(f'{len(statuses)} updates in {time.monotonic() - started:.2f} s, statuses: '
+          f'{ {status: statuses.count(status) for status in set(statuses)} }')